@@ -0,0 +1,83 @@
+"""Versioned compact JSON API (/api/v1) helpers.
+
+A v1 diagnosis leaves out the knowledge-base text (treatments and prevention
+lists) and keeps only its stable id (knowledge.kb_id), e.g. "tomato.early-blight".
+Clients fetch /api/v1/kb/<id> once and keep it: it is served with an ETag and
+a long Cache-Control max-age, and a matching If-None-Match gets a bodyless 304.
+
+Bodies are serialized compactly (orjson when installed) and compressed with
+brotli (when installed) or gzip if the client's Accept-Encoding allows it.
+"""
+import gzip
+import hashlib
+import json
+
+from flask import Response, request
+
+try:
+    import orjson
+except ImportError:  # the standard library encoder is the fallback
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # gzip only
+    brotli = None
+
+API_VERSION = 1
+KB_FIELDS = ('treatments', 'prevention', 'status_color')  # replaced by the kb id in v1 results
+KB_MAX_AGE = 24 * 3600
+MIN_COMPRESS_BYTES = 256  # smaller bodies grow or barely shrink when compressed
+
+
+def dumps(payload):
+    """Compact JSON bytes"""
+    if orjson is not None:
+        return orjson.dumps(payload)
+    return json.dumps(payload, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+
+def etag_of(body):
+    return hashlib.sha1(body).hexdigest()[:20]
+
+
+def compact_results(results):
+    """A diagnosis without the knowledge-base text, which its kb id refers to, or a heatmap image"""
+    compact = {key: value for key, value in results.items() if key not in KB_FIELDS}
+    if 'heatmap' in compact.get('grid', {}):
+        compact['grid'] = {key: value for key, value in compact['grid'].items() if key != 'heatmap'}
+    compact['v'] = API_VERSION
+    return compact
+
+
+def preferred_encoding(accept_encodings):
+    """'br', 'gzip' or None for the request's Accept-Encoding"""
+    if brotli is not None and accept_encodings['br'] and accept_encodings['br'] >= accept_encodings['gzip']:
+        return 'br'
+    if accept_encodings['gzip']:
+        return 'gzip'
+    return None
+
+
+def compress(body, encoding):
+    if encoding == 'br':
+        return brotli.compress(body, quality=5)
+    return gzip.compress(body, compresslevel=6, mtime=0)
+
+
+def api_response(payload, status=200, max_age=None, etag=None):
+    """JSON response, compressed when the client accepts it; cacheable with an ETag when max_age is set"""
+    body = dumps(payload)
+    headers = {'Vary': 'Accept-Encoding'}
+    if max_age is not None:
+        etag = etag or etag_of(body)
+        headers['ETag'] = f'"{etag}"'
+        headers['Cache-Control'] = f"public, max-age={max_age}"
+        if etag in request.if_none_match:
+            return Response(status=304, headers=headers)
+
+    encoding = preferred_encoding(request.accept_encodings) if len(body) >= MIN_COMPRESS_BYTES else None
+    if encoding:
+        body = compress(body, encoding)
+        headers['Content-Encoding'] = encoding
+    return Response(body, status=status, mimetype='application/json', headers=headers)
@@ -1,471 +1,158 @@
-from flask import Flask, render_template, request, jsonify, send_file, send_from_directory, redirect
+from flask import Flask, Response, g, has_request_context, make_response, render_template, request, jsonify, send_file, send_from_directory, redirect
 import os
+import io
+import functools
 from werkzeug.utils import secure_filename
 from PIL import Image
 import numpy as np
 import base64
 from datetime import datetime
 import json
+import hashlib
+import tempfile
 import urllib.parse
-from fpdf import FPDF
+import threading
+from stream import FrameStream
+from features import (COLUMN, CONFIDENCES, HEALTHY, PLANT_TYPE_BYTES, SYMPTOMS, FeatureStore,
+                      extract_features, load_rules_file, resolve_rules,
+                      rule_points, rules_for)
+from backends import ModelBackend, RulesBackend, backend_stats, get_backend, register_backend
+from phash import NearDuplicateIndex, dhash, image_bytes_hash
+from quality import REASONS, QualityGate
+from validation import IMAGE_LIMITS, fit_to_budget, inspect_image
+from validation import REASONS as IMAGE_REJECTIONS
+import metrics
+from qos import QOS_DEFAULTS, LoadMonitor
+from profiling import PROFILING_DEFAULTS, RequestProfiler
+from api import API_VERSION, KB_MAX_AGE, api_response, compact_results, dumps
+from knowledge import KNOWLEDGE_BASE_PATH, KnowledgeStore
+from history import EXPORT_FORMATS, HistoryStore, new_report_id, parse_time
+from shmcache import SHARED_CACHE_DEFAULTS, open_shared_cache
+from grid import GRID_DEFAULTS, grid_analysis, heatmap_data_url, heatmap_png, new_block_sums
 
-app = Flask(__name__)
+try:
+    from flask_sock import Sock
+except ImportError:  # WebSocket streaming is optional; chunked HTTP always works
+    Sock = None
 
 UPLOAD_FOLDER = 'uploads'
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg'}
 
-app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
-app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024
+def default_config():
+    """App settings, read from the environment when the app is created"""
+    return {
+        'UPLOAD_FOLDER': UPLOAD_FOLDER,
+        'MAX_CONTENT_LENGTH': 16 * 1024 * 1024,
+        'STREAM_WINDOW': 5,  # frames the live diagnosis is smoothed over
+        'HISTORY_DB': os.environ.get('HISTORY_DB', 'history.db'),
+        'FEATURE_STORE': os.environ.get('FEATURE_STORE', 'feature_store'),
+        'DISEASE_RULES': os.environ.get('DISEASE_RULES'),  # rules JSON from calibrate.py
+        'CLASSIFIER_BACKEND': os.environ.get('CLASSIFIER_BACKEND', 'rules'),
+        'MODEL_WEIGHTS': os.environ.get('MODEL_WEIGHTS'),  # .npz from calibrate.py --train-model
+        'PHASH_MAX_DISTANCE': int(os.environ.get('PHASH_MAX_DISTANCE', 4)),  # bits; -1 disables reuse
+        'PHASH_INDEX_SIZE': 1024,  # recent frames remembered per plant type
+        'PHASH_MAX_KEYS': 64,  # plant type/backend keys with an index; least recently used dropped
+        'QUALITY_GATE': os.environ.get('QUALITY_GATE', '1') != '0',  # reject junk frames before analysis
+        'QUALITY_SETTINGS': {},  # overrides of quality.QUALITY_DEFAULTS
+        'IMAGE_LIMITS': dict(IMAGE_LIMITS),  # format, pixel and decode memory limits
+        'KNOWLEDGE_BASE': os.environ.get('KNOWLEDGE_BASE', KNOWLEDGE_BASE_PATH),  # reloaded when it changes
+        'SHARED_CACHE': dict(SHARED_CACHE_DEFAULTS, enabled=os.environ.get('SHARED_CACHE', '1') != '0',
+                             directory=os.environ.get('SHARED_CACHE_DIR', SHARED_CACHE_DEFAULTS['directory'])),
+        'GRID': dict(GRID_DEFAULTS, enabled=os.environ.get('GRID_ANALYSIS', '1') != '0'),  # per-region heatmap
+        'QOS': dict(QOS_DEFAULTS, enabled=os.environ.get('QOS_ENABLED', '1') != '0'),
+        'PROFILING': dict(PROFILING_DEFAULTS, token=os.environ.get('PROFILE_TOKEN'),
+                          sample_every=int(os.environ.get('PROFILE_SAMPLE_EVERY', 0)))
+    }
+
+# Per-process state, bound by create_app() rather than at import
+config = None
+history = None
+feature_store = None
+disease_rules = None
+quality_gate = None
+load_monitor = None
+near_duplicates = None
+profiler = None
+result_cache = None  # host-wide caches shared with the other workers; None when disabled
+report_cache = None
+# Reads nothing until first used, so the knowledge base also works before create_app()
+knowledge = KnowledgeStore(os.environ.get('KNOWLEDGE_BASE', KNOWLEDGE_BASE_PATH))
+
+ROUTES = []
+SOCKET_ROUTES = []
+
+def route(rule, **options):
+    """Record a view for create_app() to register; the endpoint is the function name, as with app.route"""
+    def decorator(view):
+        ROUTES.append((rule, view, options))
+        return view
+    return decorator
+
+def socket_route(rule):
+    """Record a WebSocket view, registered only when flask_sock is installed"""
+    def decorator(view):
+        SOCKET_ROUTES.append((rule, view))
+        return view
+    return decorator
 
-# Create all necessary directories
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-os.makedirs(os.path.join(UPLOAD_FOLDER, 'diseased'), exist_ok=True)
-os.makedirs('temp_pdfs', exist_ok=True)
+def init_directories(settings):
+    """Create the upload and report directories"""
+    os.makedirs(os.path.join(settings['UPLOAD_FOLDER'], 'diseased'), exist_ok=True)
+    os.makedirs('temp_pdfs', exist_ok=True)
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-# Comprehensive disease database for all plants
-DISEASE_DATABASE = {
-    'Tomato': {
-        'Healthy': {
-            'status': 'HEALTHY',
-            'color': 'green',
-            'treatments': [
-                'Water 1-2 inches weekly at soil level',
-                'Apply balanced fertilizer every 4-6 weeks',
-                'Ensure 6-8 hours of direct sunlight daily',
-                'Prune suckers for better air circulation',
-                'Monitor for aphids and hornworms regularly'
-            ],
-            'prevention': [
-                'Rotate crops annually with non-nightshade plants',
-                'Use disease-resistant varieties like Celebrity',
-                'Space plants 24-36 inches apart',
-                'Water early morning at soil level only',
-                'Apply organic mulch to prevent soil splash'
-            ]
-        },
-        'Early Blight': {
-            'status': 'DISEASED',
-            'color': 'red',
-            'treatments': [
-                'Apply copper fungicide every 7-10 days',
-                'Remove infected leaves immediately',
-                'Use neem oil spray (2 tbsp/gallon) weekly',
-                'Apply baking soda solution (1 tbsp/gallon)',
-                'Improve air circulation through pruning'
-            ],
-            'prevention': [
-                'Avoid overhead watering completely',
-                'Rotate crops every 2-3 years',
-                'Remove plant debris after harvest',
-                'Stake plants for better air flow',
-                'Choose resistant varieties like Mountain Merit'
-            ]
-        },
-        'Late Blight': {
-            'status': 'DISEASED', 
-            'color': 'red',
-            'treatments': [
-                'Apply chlorothalonil fungicides immediately',
-                'Destroy all infected plants (do not compost)',
-                'Use hydrogen peroxide spray (1:9 ratio)',
-                'Apply compost tea weekly for immunity',
-                'Isolate affected plants immediately'
-            ],
-            'prevention': [
-                'Plant resistant varieties like Legend',
-                'Avoid working with wet plants',
-                'Ensure 36-inch plant spacing',
-                'Remove volunteer tomato plants',
-                'Use drip irrigation systems'
-            ]
-        },
-        'Leaf Spot': {
-            'status': 'DISEASED',
-            'color': 'red',
-            'treatments': [
-                'Remove affected leaves promptly',
-                'Apply copper fungicide weekly',
-                'Improve air circulation around plants',
-                'Avoid overhead watering',
-                'Use organic fungicides as preventive measure'
-            ],
-            'prevention': [
-                'Water at soil level in morning',
-                'Space plants properly for air flow',
-                'Remove plant debris regularly',
-                'Use disease-resistant varieties',
-                'Apply mulch to prevent soil splash'
-            ]
-        }
-    },
-    'Potato': {
-        'Healthy': {
-            'status': 'HEALTHY',
-            'color': 'green',
-            'treatments': [
-                'Maintain consistent soil moisture',
-                'Apply potato fertilizer (5-10-10)',
-                'Hill soil around plants as they grow',
-                'Monitor for Colorado potato beetles',
-                'Ensure well-drained soil conditions'
-            ],
-            'prevention': [
-                'Practice 3-year crop rotation',
-                'Use certified disease-free seed potatoes',
-                'Plant in well-drained soil',
-                'Remove weed hosts regularly',
-                'Harvest when fully mature'
-            ]
-        },
-        'Early Blight': {
-            'status': 'DISEASED',
-            'color': 'red',
-            'treatments': [
-                'Apply mancozeb fungicides at first sign',
-                'Remove lower infected leaves',
-                'Use copper fungicide sprays biweekly',
-                'Apply organic fungicides weekly',
-                'Improve soil drainage immediately'
-            ],
-            'prevention': [
-                'Practice long crop rotations (3-4 years)',
-                'Destroy infected plant debris',
-                'Avoid overhead irrigation',
-                'Use resistant varieties like Kennebec',
-                'Maintain proper plant spacing'
-            ]
-        },
-        'Late Blight': {
-            'status': 'DISEASED',
-            'color': 'red',
-            'treatments': [
-                'Apply systemic fungicides immediately',
-                'Destroy all infected plants and tubers',
-                'Use copper-based sprays weekly',
-                'Improve air circulation',
-                'Avoid planting in same area for 3 years'
-            ],
-            'prevention': [
-                'Use certified blight-free seed potatoes',
-                'Plant in well-drained areas',
-                'Monitor weather conditions',
-                'Apply preventive fungicides before rain',
-                'Harvest before heavy fall rains'
-            ]
-        }
-    },
-    'Banana': {
-        'Healthy': {
-            'status': 'HEALTHY',
-            'color': 'green',
-            'treatments': [
-                'Water deeply 2-3 times per week',
-                'Apply high-potassium fertilizer monthly',
-                'Maintain soil pH between 5.5-6.5',
-                'Remove dead leaves regularly',
-                'Provide wind protection for leaves'
-            ],
-            'prevention': [
-                'Plant in well-draining soil',
-                'Space plants 8-10 feet apart',
-                'Use disease-free planting material',
-                'Practice good sanitation',
-                'Monitor for Sigatoka disease regularly'
-            ]
-        },
-        'Panama Disease': {
-            'status': 'DISEASED',
-            'color': 'red',
-            'treatments': [
-                'Remove and destroy infected plants immediately',
-                'Solarize soil before replanting',
-                'Use tissue-culture planting material',
-                'Apply biocontrol agents like Trichoderma',
-                'Improve soil drainage significantly'
-            ],
-            'prevention': [
-                'Plant resistant varieties like Cavendish',
-                'Use disease-free certified plants',
-                'Avoid moving soil between fields',
-                'Practice strict field sanitation',
-                'Rotate with non-host crops'
-            ]
-        },
-        'Black Sigatoka': {
-            'status': 'DISEASED',
-            'color': 'red',
-            'treatments': [
-                'Apply systemic fungicides regularly',
-                'Remove severely infected leaves',
-                'Use mineral oil sprays for organic control',
-                'Apply potassium fertilizers to boost resistance',
-                'Improve air circulation through pruning'
-            ],
-            'prevention': [
-                'Plant resistant varieties when available',
-                'Space plants properly for air movement',
-                'Remove infected leaves promptly',
-                'Avoid overhead irrigation',
-                'Monitor weather conditions for disease favorability'
-            ]
-        }
-    },
-    'Rose': {
-        'Healthy': {
-            'status': 'HEALTHY',
-            'color': 'green',
-            'treatments': [
-                'Water deeply once weekly (2 gallons per plant)',
-                'Apply rose fertilizer (5-10-5) every 4-6 weeks',
-                'Prune dead or crossing canes regularly',
-                'Monitor for aphids and treat promptly',
-                'Mulch with 2-3 inches of organic material'
-            ],
-            'prevention': [
-                'Plant in full sun (6+ hours daily)',
-                'Space plants 3-4 feet apart',
-                'Water at base early in morning',
-                'Remove fallen leaves regularly',
-                'Choose disease-resistant varieties'
-            ]
-        },
-        'Black Spot': {
-            'status': 'DISEASED',
-            'color': 'red',
-            'treatments': [
-                'Apply fungicides containing chlorothalonil every 7-14 days',
-                'Remove and destroy infected leaves immediately',
-                'Use neem oil or sulfur sprays as alternatives',
-                'Improve air circulation by pruning crowded canes',
-                'Apply baking soda spray (1 tbsp/gallon) weekly'
-            ],
-            'prevention': [
-                'Water at soil level only, never wet foliage',
-                'Plant in morning sun locations',
-                'Space plants properly and prune for air flow',
-                'Clean up fallen leaves in autumn',
-                'Apply dormant spray in late winter'
-            ]
-        },
-        'Powdery Mildew': {
-            'status': 'DISEASED',
-            'color': 'red',
-            'treatments': [
-                'Apply potassium bicarbonate sprays weekly',
-                'Use sulfur dust or spray at first signs',
-                'Apply horticultural oil following directions',
-                'Remove severely infected leaves and canes',
-                'Improve air circulation and reduce shade'
-            ],
-            'prevention': [
-                'Plant in full sun with good air movement',
-                'Avoid overhead watering completely',
-                'Space plants properly and prune for openness',
-                'Choose resistant varieties like Knock Out',
-                'Apply preventive fungicides in spring'
-            ]
-        }
-    },
-    'Grape': {
-        'Healthy': {
-            'status': 'HEALTHY',
-            'color': 'green',
-            'treatments': [
-                'Water deeply once weekly during growing season',
-                'Apply balanced fertilizer in early spring',
-                'Prune annually during dormancy',
-                'Train vines on trellis for better growth',
-                'Monitor for pests like Japanese beetles'
-            ],
-            'prevention': [
-                'Plant in full sun with good air circulation',
-                'Space vines 6-8 feet apart',
-                'Use drip irrigation to keep leaves dry',
-                'Remove weeds that harbor diseases',
-                'Choose disease-resistant grape varieties'
-            ]
-        },
-        'Powdery Mildew': {
-            'status': 'DISEASED',
-            'color': 'red',
-            'treatments': [
-                'Apply sulfur or potassium bicarbonate sprays',
-                'Use horticultural oils for organic control',
-                'Apply fungicides containing myclobutanil',
-                'Prune to improve air circulation',
-                'Remove severely infected leaves and clusters'
-            ],
-            'prevention': [
-                'Plant in sunny, well-ventilated locations',
-                'Prune for open canopy structure',
-                'Avoid overhead irrigation completely',
-                'Apply preventive fungicides before flowering',
-                'Choose resistant varieties like Concord'
-            ]
-        },
-        'Black Rot': {
-            'status': 'DISEASED',
-            'color': 'red',
-            'treatments': [
-                'Apply fungicides at pre-bloom and fruit set',
-                'Remove and destroy infected fruit and canes',
-                'Use copper sprays during dormancy',
-                'Improve air circulation through pruning',
-                'Apply protective fungicides before rain'
-            ],
-            'prevention': [
-                'Remove all mummified fruit after harvest',
-                'Prune out infected canes during dormancy',
-                'Space vines properly for air movement',
-                'Avoid overhead watering systems',
-                'Plant resistant varieties when available'
-            ]
-        }
-    },
-    'Corn': {
-        'Healthy': {
-            'status': 'HEALTHY',
-            'color': 'green',
-            'treatments': [
-                'Water 1-1.5 inches weekly during growing season',
-                'Apply nitrogen fertilizer when plants are knee-high',
-                'Weed regularly to reduce competition',
-                'Monitor for corn earworms and borers',
-                'Ensure adequate pollination'
-            ],
-            'prevention': [
-                'Rotate crops annually with non-grass crops',
-                'Plant in blocks for better pollination',
-                'Space plants 8-12 inches apart in rows',
-                'Use disease-resistant hybrid varieties',
-                'Practice good field sanitation'
-            ]
-        },
-        'Common Rust': {
-            'status': 'DISEASED',
-            'color': 'red',
-            'treatments': [
-                'Apply fungicides at first sign of rust',
-                'Use sulfur or copper-based organic sprays',
-                'Remove severely infected leaves if practical',
-                'Apply foliar nutrients to boost plant health',
-                'Ensure proper plant spacing for air flow'
-            ],
-            'prevention': [
-                'Plant rust-resistant hybrid varieties',
-                'Avoid planting in low-lying, humid areas',
-                'Space plants for good air circulation',
-                'Remove volunteer corn plants',
-                'Apply preventive fungicides in humid regions'
-            ]
-        },
-        'Northern Leaf Blight': {
-            'status': 'DISEASED',
-            'color': 'red',
-            'treatments': [
-                'Apply fungicides containing azoxystrobin',
-                'Use chlorothalonil sprays for protection',
-                'Remove infected plant debris after harvest',
-                'Improve air circulation through proper spacing',
-                'Apply treatments at first disease detection'
-            ],
-            'prevention': [
-                'Plant resistant hybrids like DKC series',
-                'Practice crop rotation with soybeans or wheat',
-                'Plow under corn residue after harvest',
-                'Avoid continuous corn planting',
-                'Use certified disease-free seeds'
-            ]
-        }
-    }
-}
+def knowledge_base():
+    """The current knowledge-base snapshot (see knowledge.py); take it once per request"""
+    return knowledge.current()
 
 def get_plant_specific_disease(plant_type, symptom_type):
     """Get plant-specific disease based on symptoms"""
-    disease_mapping = {
-        'Tomato': {
-            'red_dominant': 'Early Blight',
-            'low_green': 'Late Blight', 
-            'high_variation': 'Leaf Spot',
-            'early_signs': 'Early Blight'
-        },
-        'Potato': {
-            'red_dominant': 'Early Blight',
-            'low_green': 'Late Blight',
-            'high_variation': 'Early Blight',
-            'early_signs': 'Early Blight'
-        },
-        'Rose': {
-            'red_dominant': 'Black Spot',
-            'low_green': 'Powdery Mildew',
-            'high_variation': 'Black Spot',
-            'early_signs': 'Black Spot'
-        },
-        'Banana': {
-            'red_dominant': 'Black Sigatoka',
-            'low_green': 'Panama Disease',
-            'high_variation': 'Black Sigatoka',
-            'early_signs': 'Black Sigatoka'
-        },
-        'Grape': {
-            'red_dominant': 'Black Rot',
-            'low_green': 'Powdery Mildew',
-            'high_variation': 'Black Rot',
-            'early_signs': 'Powdery Mildew'
-        },
-        'Corn': {
-            'red_dominant': 'Common Rust',
-            'low_green': 'Northern Leaf Blight',
-            'high_variation': 'Common Rust',
-            'early_signs': 'Common Rust'
-        }
-    }
-    
-    return disease_mapping.get(plant_type, {}).get(symptom_type, 'Leaf Spot')
+    return knowledge_base().disease_for(plant_type, symptom_type)
 
-def analyze_plant_disease(image_path, plant_type):
-    """IMPROVED plant disease detection - ACTUALLY detects disease!"""
+def analyze_plant_disease(image_path, plant_type, backend=None, max_side=None, store_features=True):
+    """IMPROVED plant disease detection - ACTUALLY detects disease!
+
+    max_side limits the decoded resolution (the cheaper tiers under load);
+    store_features=False keeps the analysis out of the feature store (warmup).
+    """
     try:
+        kb = knowledge_base()  # one snapshot for the whole analysis, even if the file is reloaded meanwhile
+        classifier = get_backend(backend or config['CLASSIFIER_BACKEND'])
         img = Image.open(image_path)
+        if max_side:
+            img.draft('RGB', (max_side, max_side))
+            img.thumbnail((max_side, max_side), Image.BILINEAR)
+        else:
+            # Oversized JPEGs are decoded at reduced size instead of blowing the memory budget
+            fit_to_budget(img, config['IMAGE_LIMITS']['memory_budget'])
         
-        if img.mode == 'RGBA':
-            img = img.convert('RGB')
+        if img.mode not in ('RGB', 'L'):
+            # Palette, CMYK, YCbCr and alpha modes would be scored on the wrong channels
+            img = img.convert('L' if img.mode in ('1', 'LA') else 'RGB')
             
         img_array = np.array(img)
         
         # Default values
         disease = "Healthy"
         confidence = "Medium"
+        grid = None
         
         if len(img_array.shape) == 3:  # Color image
-            # Extract color channels
-            red_channel = img_array[:,:,0]
-            green_channel = img_array[:,:,1]
-            blue_channel = img_array[:,:,2]
-            
-            # Calculate color statistics
-            red_mean = np.mean(red_channel)
-            green_mean = np.mean(green_channel)
-            blue_mean = np.mean(blue_channel)
-            
-            # Calculate color ratios
-            total_color = red_mean + green_mean + blue_mean
-            if total_color > 0:
-                green_ratio = green_mean / total_color
-                red_ratio = red_mean / total_color
-                blue_ratio = blue_mean / total_color
-            else:
-                green_ratio = red_ratio = blue_ratio = 0
-            
-            # Calculate color variations
-            green_std = np.std(green_channel)
-            red_std = np.std(red_channel)
-            
-            # Calculate brightness
-            avg_brightness = (red_mean + green_mean + blue_mean) / 3
+            # Per-block sums for the region heatmap come out of the same pass
+            grid_settings = config['GRID']
+            block_sums = None
+            if grid_settings['enabled'] and min(img_array.shape[:2]) >= grid_settings['size']:
+                block_sums = new_block_sums(grid_settings['size'])
+            features, hist = extract_features(img_array, block_sums=block_sums)
+            green_ratio = float(features[COLUMN['green_ratio']])
+            red_ratio = float(features[COLUMN['red_ratio']])
+            blue_ratio = float(features[COLUMN['blue_ratio']])
+            green_std = float(features[COLUMN['green_std']])
+            avg_brightness = float(features[COLUMN['brightness']])
+            lesion_fraction = float(features[COLUMN['lesion_fraction']])
+            chlorosis_fraction = float(features[COLUMN['chlorosis_fraction']])
             
             print(f"\n🔍 ANALYZING IMAGE:")
             print(f"   Green ratio: {green_ratio:.3f}")
@@ -473,92 +160,62 @@ def analyze_plant_disease(image_path, plant_type):
             print(f"   Blue ratio: {blue_ratio:.3f}")
             print(f"   Green variation: {green_std:.1f}")
             print(f"   Brightness: {avg_brightness:.1f}")
+            print(f"   Leaf area: {features[COLUMN['leaf_fraction']]:.3f}")
+            print(f"   Lesion pixels: {lesion_fraction:.3f} of leaf")
+            print(f"   Chlorotic pixels: {chlorosis_fraction:.3f} of leaf")
             
             # ============ DISEASE DETECTION LOGIC ============
-            disease_score = 0
-            
-            # 1. LOW GREEN COLOR - Major disease indicator
-            if green_ratio < 0.30:  # More sensitive threshold
-                disease_score += 3
-                print(f"   ⚠️ LOW GREEN: {green_ratio:.3f} (adds 3 points)")
+            # Thresholds and points live in features.DEFAULT_RULES so stored
+            # features can be re-scored with exactly the same rules
+            rules = rules_for(disease_rules, plant_type)
+            points = rule_points(features, rules)
+            indicators = {
+                'low_green': f"LOW GREEN: {green_ratio:.3f}",
+                'high_red': f"HIGH RED: {red_ratio:.3f}",
+                'red_over_green': f"RED > GREEN: {red_ratio:.3f} > {green_ratio:.3f}",
+                'high_variation': f"HIGH VARIATION: {green_std:.1f}",
+                'low_brightness': f"LOW BRIGHTNESS: {avg_brightness:.1f}",
+                'low_blue': f"LOW BLUE: {blue_ratio:.3f}",
+                'lesions': f"LESIONS: {lesion_fraction:.3f}",
+                'chlorosis': f"CHLOROSIS: {chlorosis_fraction:.3f}"
+            }
+            for name, message in indicators.items():
+                if points[name]:
+                    print(f"   ⚠️ {message} (adds {points[name]} points)")
             
-            # 2. HIGH RED COLOR - Disease/stress indicator
-            if red_ratio > 0.40:  # More sensitive threshold
-                disease_score += 2
-                print(f"   ⚠️ HIGH RED: {red_ratio:.3f} (adds 2 points)")
+            disease_score = int(sum(points.values()))
+            print(f"   📊 TOTAL DISEASE SCORE: {disease_score}/{sum(rules['points'].values())}")
             
-            # 3. RED > GREEN - Stress condition
-            if red_ratio > green_ratio:
-                disease_score += 2
-                print(f"   ⚠️ RED > GREEN: {red_ratio:.3f} > {green_ratio:.3f} (adds 2 points)")
+            if block_sums is not None:
+                grid = grid_analysis(block_sums, img_array.shape, rules, grid_settings)
+                for block in grid['worst']:
+                    print(f"   🗺️ HOT REGION row {block['row']} col {block['col']}: score {block['score']}, "
+                          f"lesions {block['lesion_fraction']:.3f}")
             
-            # 4. HIGH COLOR VARIATION - Spots/lesions
-            if green_std > 50:  # More sensitive
-                disease_score += 1
-                print(f"   ⚠️ HIGH VARIATION: {green_std:.1f} (adds 1 point)")
-            
-            # 5. LOW BRIGHTNESS - Dead/dying leaves
-            if avg_brightness < 120:
-                disease_score += 1
-                print(f"   ⚠️ LOW BRIGHTNESS: {avg_brightness:.1f} (adds 1 point)")
-            
-            # 6. LOW BLUE RATIO - Chlorosis (yellowing)
-            if blue_ratio < 0.20:
-                disease_score += 1
-                print(f"   ⚠️ LOW BLUE: {blue_ratio:.3f} (adds 1 point)")
-            
-            print(f"   📊 TOTAL DISEASE SCORE: {disease_score}/10")
+            symptoms, confidences = classifier.predict(features[None], hist[None], [plant_type])
+            symptom, confidence_code = int(symptoms[0]), int(confidences[0])
+            if classifier.name != 'rules':
+                print(f"   🧠 {classifier.name.upper()} BACKEND: {SYMPTOMS[symptom]} ({CONFIDENCES[confidence_code]})")
             
             # ============ DECISION MAKING ============
-            
-            # HIGH disease probability
-            if disease_score >= 6:
-                disease = get_plant_specific_disease(plant_type, "red_dominant")
-                confidence = "Very High"
-                print(f"   🔴 DEFINITELY DISEASED: {disease}")
-            
-            # MODERATE disease probability
-            elif disease_score >= 4:
-                if red_ratio > green_ratio:
-                    disease = get_plant_specific_disease(plant_type, "red_dominant")
-                else:
-                    disease = get_plant_specific_disease(plant_type, "low_green")
-                confidence = "High"
-                print(f"   🟡 LIKELY DISEASED: {disease}")
-            
-            # MILD disease probability
-            elif disease_score >= 2:
-                disease = get_plant_specific_disease(plant_type, "early_signs")
-                confidence = "Medium"
-                print(f"   🟠 POSSIBLE EARLY DISEASE: {disease}")
-            
-            # BORDERLINE - check specific conditions
-            elif disease_score == 1:
-                if green_ratio < 0.32:
-                    disease = "Healthy"
-                    confidence = "Low"
-                    print(f"   🟢 BORDERLINE HEALTHY")
-                else:
-                    disease = "Healthy"
-                    confidence = "High"
-                    print(f"   🟢 HEALTHY (minor indicator)")
-            
-            # DEFINITELY HEALTHY
-            else:
+            confidence = CONFIDENCES[confidence_code]
+            if symptom == HEALTHY:
                 disease = "Healthy"
-                confidence = "High"
-                print(f"   🟢 DEFINITELY HEALTHY")
+                print(f"   🟢 HEALTHY (score {disease_score})")
+            else:
+                disease = kb.disease_for(plant_type, SYMPTOMS[symptom])
+                print(f"   🔴 DISEASED: {disease}")
                 
         else:  # Grayscale image
-            gray_mean = np.mean(img_array)
-            gray_std = np.std(img_array)
+            gray_mean = float(np.mean(img_array))  # plain floats: orjson rejects NumPy scalars
+            gray_std = float(np.std(img_array))
             
             print(f"\n🔍 ANALYZING GRAYSCALE IMAGE:")
             print(f"   Brightness: {gray_mean:.1f}")
             print(f"   Variation: {gray_std:.1f}")
             
             if gray_mean < 100 or gray_std > 60:
-                disease = get_plant_specific_disease(plant_type, "low_green")
+                disease = kb.disease_for(plant_type, "low_green")
                 confidence = "Medium"
                 print(f"   🔴 GRAYSCALE DISEASED: {disease}")
             else:
@@ -569,14 +226,18 @@ def analyze_plant_disease(image_path, plant_type):
             green_ratio = gray_mean / 255
             red_ratio = 0
             green_std = gray_std
+            lesion_fraction = chlorosis_fraction = 0.0
         
         # Get disease info from database
-        disease_info = DISEASE_DATABASE.get(plant_type, {}).get(disease, {
-            'status': 'HEALTHY' if disease == 'Healthy' else 'DISEASED',
-            'color': 'green' if disease == 'Healthy' else 'red',
-            'treatments': ['Consult agricultural expert for accurate diagnosis'],
-            'prevention': ['Practice good plant care and regular monitoring']
-        })
+        disease_info = kb.info(plant_type, disease)
+        
+        report_id = new_report_id()
+        if store_features and len(img_array.shape) == 3:
+            try:
+                feature_store.append(report_id, plant_type, features, hist,
+                                     disease_score, symptom, confidence_code)
+            except OSError as e:
+                print(f"❌ Error storing features: {e}")
         
         results = {
             'plant_type': plant_type,
@@ -584,14 +245,21 @@ def analyze_plant_disease(image_path, plant_type):
             'status': disease_info['status'],
             'status_color': disease_info['color'],
             'confidence': confidence,
+            'classifier': classifier.name,
             'green_ratio': round(green_ratio, 3),
             'red_ratio': round(red_ratio, 3),
             'color_variation': round(green_std, 2),
+            'lesion_fraction': round(lesion_fraction, 3),
+            'chlorosis_fraction': round(chlorosis_fraction, 3),
             'treatments': disease_info['treatments'],
             'prevention': disease_info['prevention'],
+            'kb': kb.entry_id(plant_type, disease, disease_info['status']),
+            'kb_version': kb.version,
             'analysis_date': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            'report_id': f"RPT{np.random.randint(10000, 99999)}"
+            'report_id': report_id
         }
+        if grid:
+            results['grid'] = grid
         
         print(f"✅ FINAL RESULT: {disease} (Confidence: {confidence})\n")
         return results
@@ -600,38 +268,175 @@ def analyze_plant_disease(image_path, plant_type):
         print(f"❌ Error in analysis: {e}")
         return {'error': str(e)}
 
+def decode_base64_image(base64_string):
+    """Decode a base64 (optionally data-URL) image string to bytes"""
+    if ',' in base64_string:
+        base64_string = base64_string.split(',')[1]
+    
+    # Add padding if needed
+    missing_padding = len(base64_string) % 4
+    if missing_padding:
+        base64_string += '=' * (4 - missing_padding)
+    
+    return base64.b64decode(base64_string)
+
+def plant_type_error(plant_type):
+    """Why a requested plant type cannot be analysed (too long to store), or None"""
+    if not isinstance(plant_type, str):
+        return 'plant_type must be a string'
+    if len(plant_type.encode('utf-8')) > PLANT_TYPE_BYTES:
+        return f'plant_type must be at most {PLANT_TYPE_BYTES} bytes'
+    return None
+
+def save_image_bytes(image_data, filename):
+    """Write raw image bytes to the diseased uploads folder"""
+    filepath = os.path.join(config['UPLOAD_FOLDER'], 'diseased', filename)
+    with open(filepath, 'wb') as f:
+        f.write(image_data)
+    return filepath
+
 def save_base64_image(base64_string, filename):
     """Save base64 image from camera"""
     try:
-        if ',' in base64_string:
-            base64_string = base64_string.split(',')[1]
-        
-        # Add padding if needed
-        missing_padding = len(base64_string) % 4
-        if missing_padding:
-            base64_string += '=' * (4 - missing_padding)
-        
-        image_data = base64.b64decode(base64_string)
+        image_data = decode_base64_image(base64_string)
         
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], 'diseased', filename)
-        
-        with open(filepath, 'wb') as f:
-            f.write(image_data)
-        
-        return filepath
+        return save_image_bytes(image_data, filename)
         
     except Exception as e:
         print(f"❌ Error saving image: {e}")
         return None
 
+def qos_tracked(view):
+    """Track the request in the load monitor and put its analysis tier in g.analysis_tier"""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        with load_monitor.track(request.headers) as tier:
+            g.analysis_tier = tier
+            if tier != 'full':
+                metrics.incr(f"qos_tier.{tier}")
+            return view(*args, **kwargs)
+    return wrapper
+
+def profiled(view):
+    """Run the view under cProfile and tracemalloc when the caller asks for it or the request is sampled"""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if not profiler.requested(request.headers, request.args):
+            return view(*args, **kwargs)
+        with profiler.profile(request.endpoint, {'method': request.method, 'path': request.path,
+                                                 'content_length': request.content_length}) as report:
+            response = make_response(view(*args, **kwargs))
+            if report is not None:
+                report['status'] = response.status_code
+                report['image'] = g.get('image_info')
+                report['analysis_tier'] = g.get('analysis_tier')
+        if report is not None:
+            response.headers['X-Profile-Id'] = report['id']
+        return response
+    return wrapper
+
+def api_v1(view):
+    """Serve a view's diagnosis in the compact /api/v1 form"""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        g.api_version = API_VERSION
+        return view(*args, **kwargs)
+    return wrapper
+
+def results_response(results, template=None):
+    """The full results (JSON, or the template when given), or the compact form for /api/v1 callers.
+
+    `?heatmap=1` adds the grid heatmap as a PNG data URL to the full form; it is rendered here,
+    not during analysis, and never sent in the compact form.
+    """
+    if g.get('api_version'):
+        return api_response(compact_results(results))
+    if request.args.get('heatmap') == '1' and results.get('grid'):
+        heatmap = heatmap_data_url(results['grid'], config['GRID']['cell_px'])
+        results = dict(results, grid=dict(results['grid'], heatmap=heatmap))
+    if template:
+        return render_template(template, results=results)
+    return jsonify(results)
+
+def result_cache_key(image_bytes, plant_type, backend, tier):
+    """Identity of an analysis by content: image, plant, classifier weights or rules, scoring rules,
+    grid settings, tier and knowledge base, so the shared cache never outlives a deploy or an edit"""
+    digest = hashlib.sha256(image_bytes).hexdigest()
+    try:
+        classifier = get_backend(backend).fingerprint
+    except Exception:
+        classifier = None  # unknown backend or unreadable weights: the analysis itself reports the error
+    rules = get_backend('rules').fingerprint  # scoring and the grid use the rules whatever the classifier
+    grid = json.dumps(config['GRID'], sort_keys=True)
+    return (f"{digest}/{plant_type}/{backend}/{classifier}/{rules}/{grid}/{tier}/"
+            f"{knowledge_base().hash}")
+
+def cached_results(key):
+    """Results of the same analysis done by any worker, re-issued under a new report id; None on a miss"""
+    if result_cache is None:
+        return None
+    cached = result_cache.get(key)
+    if cached is None:
+        return None
+    return dict(json.loads(cached),
+                report_id=new_report_id(),
+                analysis_date=datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                cache_hit=True)
+
+def cache_results(key, results):
+    if result_cache is not None:
+        result_cache.set(key, dumps(results))
+
+def check_image_header(image_bytes):
+    """Validate format, size and decode cost from the header; (reason, info)"""
+    reason, info = inspect_image(image_bytes, config['IMAGE_LIMITS'])
+    if has_request_context():
+        g.image_info = info  # for the request profiler
+    if reason:
+        metrics.incr(f"image_rejected.{reason}")
+        print(f"⚠️ Image rejected ({reason}): {info}")
+    elif info['decode_scale'] > 1:
+        metrics.incr('image_downscaled')
+    return reason, info
+
+def image_rejection(reason, info):
+    """413/422 response for an image that failed header validation"""
+    status = 413 if reason in ('too_many_pixels', 'too_large') else 422
+    return jsonify({
+        'error': f"Image rejected: {IMAGE_REJECTIONS[reason]}",
+        'reason': reason,
+        'image': info
+    }), status
+
+def quality_rejection(reason, quality_metrics):
+    """422 response for an image the quality gate turned away"""
+    metrics.incr(f"quality_rejected.{reason}")
+    return jsonify({
+        'error': f"Image rejected: {REASONS[reason]}",
+        'reason': reason,
+        'metrics': quality_metrics
+    }), 422
+
+def stream_precheck(frame_bytes):
+    reason, info = check_image_header(frame_bytes)
+    if reason:
+        return reason, info
+    if not config['QUALITY_GATE']:
+        return None, None
+    reason, quality_metrics, _ = quality_gate.check(frame_bytes)
+    if reason:
+        metrics.incr(f"quality_rejected.{reason}")
+    return reason, quality_metrics
+
 def clean_text(text):
     """Remove emojis and non-ASCII characters for PDF"""
     if not text:
         return ""
     return ''.join(char for char in str(text) if ord(char) < 128)
 
-def create_professional_pdf(results):
+def create_professional_pdf(results, embed_image=True):
     """Create PDF report WITHOUT emojis"""
+    from fpdf import FPDF  # imported on first report, not at startup
     pdf = FPDF('P', 'mm', 'A4')
     pdf.add_page()
     
@@ -706,9 +511,9 @@ def create_professional_pdf(results):
     
     pdf.ln(10)
     
-    if 'image_filename' in results:
+    if embed_image and 'image_filename' in results:
         try:
-            image_path = os.path.join(app.config['UPLOAD_FOLDER'], 'diseased', results['image_filename'])
+            image_path = os.path.join(config['UPLOAD_FOLDER'], 'diseased', results['image_filename'])
             if os.path.exists(image_path):
                 pdf.set_font('Arial', 'B', 14)
                 pdf.set_text_color(46, 125, 50)
@@ -747,6 +552,8 @@ def create_professional_pdf(results):
         ('Green Color Ratio', f"{results.get('green_ratio', 0):.3f}", 'Good' if results.get('green_ratio', 0) > 0.3 else 'Poor'),
         ('Red Color Ratio', f"{results.get('red_ratio', 0):.3f}", 'Good' if results.get('red_ratio', 0) < 0.4 else 'High'),
         ('Color Variation', f"{results.get('color_variation', 0):.2f}", 'Good' if results.get('color_variation', 0) < 50 else 'High'),
+        ('Lesion Area', f"{results.get('lesion_fraction', 0):.3f}", 'Good' if results.get('lesion_fraction', 0) <= 0.08 else 'High'),
+        ('Chlorotic Area', f"{results.get('chlorosis_fraction', 0):.3f}", 'Good' if results.get('chlorosis_fraction', 0) <= 0.2 else 'High'),
         ('Analysis Confidence', results.get('confidence', 'N/A'), results.get('confidence', 'N/A')),
         ('Plant Health Status', results.get('status', 'N/A'), results.get('status', 'N/A'))
     ]
@@ -768,6 +575,47 @@ def create_professional_pdf(results):
     
     pdf.ln(15)
     
+    # REGION HEATMAP
+    grid = results.get('grid')
+    if grid and grid.get('scores'):
+        try:
+            pdf.add_page()
+            pdf.set_font('Arial', 'B', 14)
+            pdf.set_text_color(46, 125, 50)
+            pdf.cell(0, 10, 'DISEASE HEATMAP', 0, 1, 'L')
+            pdf.line(10, pdf.get_y(), 200, pdf.get_y())
+            pdf.ln(5)
+            
+            pdf.set_font('Arial', 'I', 10)
+            pdf.set_text_color(100, 100, 100)
+            pdf.multi_cell(0, 5, f"Disease score of each block of a {grid['size']} x {grid['size']} grid over the "
+                                 f"image: green 0, red {grid['scale']} or more, grey background.")
+            pdf.ln(3)
+            
+            with tempfile.NamedTemporaryFile(suffix='.png', delete=False) as f:
+                f.write(heatmap_png(grid, config['GRID']['cell_px']))
+            try:
+                pdf.image(f.name, x=(210 - 70) / 2, y=pdf.get_y(), w=70, h=70)
+            finally:
+                os.remove(f.name)
+            pdf.set_y(pdf.get_y() + 75)
+            
+            if grid.get('worst'):
+                pdf.set_font('Arial', 'B', 11)
+                pdf.set_fill_color(240, 240, 240)
+                pdf.set_text_color(0, 0, 0)
+                for label, width in (('Region (row, col)', 70), ('Score', 40), ('Lesion Area', 40), ('Chlorotic Area', 40)):
+                    pdf.cell(width, 10, label, 1, 0, 'C', 1)
+                pdf.ln()
+                pdf.set_font('Arial', '', 10)
+                for block in grid['worst']:
+                    pdf.cell(70, 8, f"{block['row'] + 1}, {block['col'] + 1}", 1, 0, 'C')
+                    pdf.cell(40, 8, str(block['score']), 1, 0, 'C')
+                    pdf.cell(40, 8, f"{block['lesion_fraction']:.3f}", 1, 0, 'C')
+                    pdf.cell(40, 8, f"{block['chlorosis_fraction']:.3f}", 1, 1, 'C')
+        except Exception as e:
+            print(f"PDF heatmap error: {e}")
+    
     # PAGE 3: TREATMENTS
     pdf.add_page()
     
@@ -823,50 +671,83 @@ def create_professional_pdf(results):
     return pdf
 
 # Image serving endpoint
-@app.route('/uploads/diseased/<filename>')
+@route('/uploads/diseased/<filename>')
 def uploaded_file(filename):
     """Serve uploaded images"""
     try:
-        return send_from_directory(os.path.join(app.config['UPLOAD_FOLDER'], 'diseased'), filename)
+        return send_from_directory(os.path.join(config['UPLOAD_FOLDER'], 'diseased'), filename)
     except:
         return "Image not found", 404
 
 # Routes
-@app.route('/')
+@route('/')
 def welcome():
     return render_template('welcome.html')
 
-@app.route('/detect')
+@route('/detect')
 def detect():
     return render_template('detect.html')
 
-@app.route('/upload', methods=['POST'])
+@route('/upload', methods=['POST'])
+@profiled
+@qos_tracked
 def upload_file():
     if 'plant_photo' not in request.files:
         return jsonify({'error': 'No file uploaded'}), 400
     
     file = request.files['plant_photo']
     plant_type = request.form.get('plant_type', 'Tomato')
+    error = plant_type_error(plant_type)
+    if error:
+        return jsonify({'error': error}), 400
     
     if file.filename == '':
         return jsonify({'error': 'No file selected'}), 400
     
     if file and allowed_file(file.filename):
         filename = secure_filename(file.filename)
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], 'diseased', filename)
-        file.save(filepath)
+        image_bytes = file.read()
+        
+        reason, info = check_image_header(image_bytes)
+        if reason:
+            return image_rejection(reason, info)
+        
+        if config['QUALITY_GATE']:
+            reason, quality_metrics, _ = quality_gate.check(image_bytes)
+            if reason:
+                return quality_rejection(reason, quality_metrics)
         
-        results = analyze_plant_disease(filepath, plant_type)
+        tier = g.analysis_tier
+        backend = request.form.get('backend') or config['CLASSIFIER_BACKEND']
+        cache_key = result_cache_key(image_bytes, plant_type, backend, tier)
+        results = cached_results(cache_key)
+        if results:
+            history.record(results, source='upload_cached')
+            return results_response(results, 'results.html')
+        
+        if tier == 'full':
+            image_source = save_image_bytes(image_bytes, filename)
+        else:
+            image_source = io.BytesIO(image_bytes)  # under load: skip persisting the upload
+        
+        results = analyze_plant_disease(image_source, plant_type, backend,
+                                        max_side=load_monitor.max_side(tier))
         if 'error' in results:
             return jsonify(results), 500
             
-        results['image_filename'] = filename
+        results['analysis_tier'] = tier
+        if tier == 'full':
+            results['image_filename'] = filename
+        history.record(results, source='upload')
+        cache_results(cache_key, results)
         
-        return render_template('results.html', results=results)
+        return results_response(results, 'results.html')
     
     return jsonify({'error': 'Invalid file type'}), 400
 
-@app.route('/capture', methods=['POST'])
+@route('/capture', methods=['POST'])
+@profiled
+@qos_tracked
 def capture_image():
     """Handle image capture from camera"""
     try:
@@ -876,30 +757,313 @@ def capture_image():
         
         image_data = data.get('image')
         plant_type = data.get('plant_type', 'Tomato')
+        error = plant_type_error(plant_type)
+        if error:
+            return jsonify({'error': error}), 400
         
         if not image_data:
             return jsonify({'error': 'No image data'}), 400
         
-        if ',' in image_data:
-            image_data = image_data.split(',')[1]
+        image_bytes = decode_base64_image(image_data)
+        backend = data.get('backend') or config['CLASSIFIER_BACKEND']
+        
+        reason, info = check_image_header(image_bytes)
+        if reason:
+            return image_rejection(reason, info)
+        
+        thumbnail = None
+        if config['QUALITY_GATE']:
+            reason, quality_metrics, thumbnail = quality_gate.check(image_bytes)
+            if reason:
+                return quality_rejection(reason, quality_metrics)
+        
+        # Byte-identical image already analysed by any worker on this host
+        tier = g.analysis_tier
+        cache_key = result_cache_key(image_bytes, plant_type, backend, tier)
+        results = cached_results(cache_key)
+        if results:
+            history.record(results, source='capture_cached')
+            return results_response(results)
+        
+        # Near-identical frame of the same leaf: reuse its diagnosis, skip save + analysis.
+        # Keyed by analysis tier, so a thumbnail diagnosis made under load is not reused at full
+        # resolution, and by knowledge-base content, so a reload stops reuse of the old advice.
+        duplicate_key = f"{plant_type}/{backend}/{tier}/{knowledge_base().hash}"
+        try:
+            image_hash = dhash(thumbnail) if thumbnail else image_bytes_hash(image_bytes)
+        except Exception as e:
+            print(f"⚠️ Could not hash frame: {e}")
+            image_hash = None
+        if image_hash is not None and config['PHASH_MAX_DISTANCE'] >= 0:
+            match = near_duplicates.lookup(duplicate_key, image_hash)
+            if match:
+                cached, distance = match
+                results = dict(cached,
+                               report_id=new_report_id(),
+                               analysis_date=datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                               cache_hit=True,
+                               hash_distance=distance)
+                history.record(results, source='capture_cached')
+                return results_response(results)
         
         filename = f"capture_{datetime.now().strftime('%Y%m%d_%H%M%S')}.jpg"
-        filepath = save_base64_image(image_data, filename)
+        if tier == 'full':
+            try:
+                filepath = save_image_bytes(image_bytes, filename)
+            except OSError as e:
+                print(f"❌ Error saving image: {e}")
+                filepath = None
+        else:
+            filepath = io.BytesIO(image_bytes)  # under load: skip persisting the frame
         
         if filepath:
-            results = analyze_plant_disease(filepath, plant_type)
+            results = analyze_plant_disease(filepath, plant_type, backend,
+                                            max_side=load_monitor.max_side(tier))
             if 'error' in results:
                 return jsonify(results), 500
                 
-            results['image_filename'] = filename
-            return jsonify(results)
+            results['analysis_tier'] = tier
+            if tier == 'full':
+                results['image_filename'] = filename
+            history.record(results, source='capture')
+            cache_results(cache_key, results)
+            if image_hash is not None:
+                near_duplicates.add(duplicate_key, image_hash, results)
+            return results_response(results)
         else:
             return jsonify({'error': 'Failed to save image'}), 500
             
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@app.route('/results')
+route('/api/v1/upload', methods=['POST'], endpoint='api_v1_upload')(api_v1(upload_file))
+route('/api/v1/capture', methods=['POST'], endpoint='api_v1_capture')(api_v1(capture_image))
+
+@route('/api/v1/kb')
+def api_v1_kb_index():
+    """Every knowledge-base id with its current ETag, so clients can refresh only what changed"""
+    kb = knowledge_base()
+    return api_response({'v': API_VERSION, 'version': kb.version, 'entries': kb.etags})
+
+@route('/api/v1/kb/<entry_id>')
+def api_v1_kb(entry_id):
+    """Treatments and prevention text of one knowledge-base entry; cacheable"""
+    kb = knowledge_base()
+    entry = kb.entries.get(entry_id)
+    if entry is None:
+        return api_response({'error': f"Unknown knowledge base id: {entry_id}"}, 404)
+    return api_response(entry, max_age=KB_MAX_AGE, etag=kb.etags[entry_id])
+
+def analyze_stream_frame(image, plant_type):
+    """Analyse one streamed frame as one tracked request, at the tier the current load allows.
+
+    Frames are tracked one by one rather than per connection: a stream lasting minutes
+    would otherwise count as a single, very slow request.
+    """
+    with load_monitor.track() as tier:
+        if tier != 'full':
+            metrics.incr(f"qos_tier.{tier}")
+        results = analyze_plant_disease(image, plant_type, max_side=load_monitor.max_side(tier))
+    if 'error' not in results:
+        results['analysis_tier'] = tier
+    return results
+
+def persist_stream_frame(frame_bytes, results):
+    """Save a streamed frame whose diagnosis differs from the previous one (only the record under load)"""
+    if results.get('analysis_tier', 'full') != 'full':
+        history.record(results, source='stream')
+        return None
+    filename = f"stream_{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}.jpg"
+    try:
+        save_image_bytes(frame_bytes, filename)
+        history.record(dict(results, image_filename=filename), source='stream')
+        return filename
+    except OSError as e:
+        print(f"❌ Error saving stream frame: {e}")
+        return None
+
+def new_frame_stream(plant_type):
+    return FrameStream(analyze_stream_frame, plant_type,
+                       window=config['STREAM_WINDOW'],
+                       on_change=persist_stream_frame,
+                       precheck=stream_precheck)
+
+@route('/stream', methods=['POST'])
+def stream_capture():
+    """Live camera analysis over one chunked HTTP request.
+
+    The client streams newline-delimited JSON frames ({"image": base64, "plant_type": ...})
+    and reads newline-delimited JSON updates back on the same connection. MAX_CONTENT_LENGTH
+    limits each frame, not the connection: a chunked body is read from the raw input, since
+    request.stream would end the stream once the total passed it.
+    """
+    plant_type = request.args.get('plant_type', 'Tomato')
+    error = plant_type_error(plant_type)
+    if error:
+        return jsonify({'error': error}), 400
+    frames = new_frame_stream(plant_type)
+    max_frame = config['MAX_CONTENT_LENGTH']
+    if request.environ.get('wsgi.input_terminated'):
+        body = request.environ['wsgi.input']
+        if isinstance(body, io.RawIOBase):
+            body = io.BufferedReader(body)  # efficient readline over the dev server's dechunker
+    else:
+        body = request.stream
+
+    def read_frames():
+        try:
+            while True:
+                line = body.readline(max_frame + 1)
+                if not line:
+                    break
+                if len(line) > max_frame:
+                    frames.close(f"Frame larger than {max_frame} bytes")
+                    break
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    frame = json.loads(line)
+                    error = frame.get('plant_type') and plant_type_error(frame['plant_type'])
+                    if error:
+                        raise ValueError(error)
+                    frames.submit(decode_base64_image(frame['image']), frame.get('plant_type'))
+                except (ValueError, KeyError, TypeError) as e:
+                    print(f"❌ Bad stream frame: {e}")
+        except Exception as e:
+            print(f"❌ Stream input failed: {e}")
+            frames.close(f"Stream input failed: {e}")
+        finally:
+            frames.close()
+
+    threading.Thread(target=read_frames, daemon=True).start()
+
+    def generate():
+        for update in frames.updates():
+            yield json.dumps(update) + '\n'
+
+    return Response(generate(), mimetype='application/x-ndjson')
+
+@socket_route('/ws/stream')
+def stream_websocket(ws):
+    """Live camera analysis over a WebSocket; each message is a base64 frame or raw image bytes"""
+    plant_type = request.args.get('plant_type', 'Tomato')
+    error = plant_type_error(plant_type)
+    if error:
+        ws.send(json.dumps({'error': error}))
+        return
+    frames = new_frame_stream(plant_type)
+
+    def read_frames():
+        try:
+            while True:
+                message = ws.receive()
+                if message is None:
+                    break
+                frames.submit(message if isinstance(message, bytes) else decode_base64_image(message))
+        except Exception as e:
+            print(f"❌ WebSocket closed: {e}")
+        finally:
+            frames.close()
+
+    threading.Thread(target=read_frames, daemon=True).start()
+    for update in frames.updates():
+        ws.send(json.dumps(update))
+
+def history_filters(args):
+    return {name: args.get(name) for name in ('plant_type', 'disease', 'status', 'since', 'until')}
+
+@route('/history')
+def history_list():
+    """Stored analyses, newest first, one keyset-paginated page at a time"""
+    try:
+        try:
+            limit = max(1, min(int(request.args.get('limit', 50)), 500))
+        except ValueError:
+            return jsonify({'error': 'limit must be an integer'}), 400
+        items, next_cursor = history.query(history_filters(request.args), limit=limit,
+                                           after=request.args.get('after'))
+        return jsonify({'items': items, 'next': next_cursor})
+    except ValueError as e:
+        return jsonify({'error': f'Invalid query: {e}'}), 400
+
+@route('/history/trend')
+def history_trend():
+    """Diagnosis counts per hour or day for the given filters"""
+    bucket = request.args.get('bucket', 'day')
+    if bucket not in ('hour', 'day'):
+        return jsonify({'error': 'bucket must be hour or day'}), 400
+    try:
+        return jsonify({'bucket': bucket, 'trend': history.trend(history_filters(request.args), bucket)})
+    except ValueError as e:
+        return jsonify({'error': f'Invalid query: {e}'}), 400
+
+@route('/history/export')
+def history_export():
+    """Stream stored analyses as CSV or JSON Lines (chunked, constant memory)"""
+    fmt = request.args.get('format', 'csv')
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({'error': 'format must be csv or jsonl'}), 400
+    try:
+        filters = history_filters(request.args)
+        for name in ('since', 'until'):
+            parse_time(filters[name])
+    except ValueError as e:
+        return jsonify({'error': f'Invalid query: {e}'}), 400
+
+    filename = f"plant_analyses_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{fmt}"
+    return Response(
+        history.export(filters, fmt),
+        mimetype=EXPORT_FORMATS[fmt],
+        headers={'Content-Disposition': f'attachment; filename={filename}'}
+    )
+
+@route('/history/<report_id>')
+def history_report(report_id):
+    row = history.get(report_id)
+    if row is None:
+        return jsonify({'error': 'Report not found'}), 404
+    return jsonify(row)
+
+@route('/features/rescore', methods=['POST'])
+def features_rescore():
+    """Re-evaluate every stored feature vector with a new rule set (JSON overrides of DEFAULT_RULES, optionally per plant)"""
+    try:
+        rules = resolve_rules(request.get_json(silent=True) or {})
+    except (ValueError, AttributeError, TypeError) as e:
+        return jsonify({'error': f'Invalid rules: {e}'}), 400
+    return jsonify(feature_store.rescore(rules))
+
+@route('/backends')
+def backends():
+    """Classifier backends with load time and per-image latency"""
+    return jsonify({'default': config['CLASSIFIER_BACKEND'], 'backends': backend_stats()})
+
+@route('/phash/stats')
+def phash_stats():
+    """Near-duplicate frame reuse: hit rate and nearest-distance histogram"""
+    return jsonify(near_duplicates.stats())
+
+@route('/quality/stats')
+def quality_stats():
+    """Images checked by the quality gate and rejections per reason"""
+    return jsonify(dict(quality_gate.stats(), enabled=config['QUALITY_GATE']))
+
+@route('/metrics')
+def metrics_page():
+    """Process counters plus the quality gate, near-duplicate and backend statistics"""
+    return jsonify(dict(
+        metrics.snapshot(),
+        quality_gate=quality_gate.stats(),
+        near_duplicates=near_duplicates.stats(),
+        qos=load_monitor.stats(),
+        knowledge=knowledge.stats(),
+        shared_cache={name: cache.stats() for name, cache in (('results', result_cache), ('reports', report_cache))
+                      if cache is not None},
+        backends=backend_stats()
+    ))
+
+@route('/results')
 def results_page():
     """Display results page"""
     try:
@@ -912,7 +1076,9 @@ def results_page():
     except:
         return redirect('/detect')
 
-@app.route('/generate_report', methods=['GET'])
+@route('/generate_report', methods=['GET'])
+@profiled
+@qos_tracked
 def generate_report():
     """Generate professional PDF report"""
     try:
@@ -923,14 +1089,27 @@ def generate_report():
         results_data = urllib.parse.unquote(results_data)
         results = json.loads(results_data)
         
+        embed_image = g.analysis_tier == 'full'
+        filename = f"Plant_Health_Report_{results.get('plant_type', 'Unknown')}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf"
+        
+        # The same report rendered by any worker on this host: serve its bytes
+        cache_key = f"{hashlib.sha256(results_data.encode('utf-8')).hexdigest()}/{embed_image}"
+        cached = report_cache.get(cache_key) if report_cache is not None else None
+        if cached is not None:
+            print(f"📄 Serving cached PDF report for {results.get('plant_type')}")
+            return send_file(io.BytesIO(cached), as_attachment=True, download_name=filename,
+                             mimetype='application/pdf')
+        
         print(f"📄 Generating PDF report for {results.get('plant_type')}...")
         
-        pdf = create_professional_pdf(results)
+        pdf = create_professional_pdf(results, embed_image=embed_image)
+        pdf_bytes = pdf.output(dest='S').encode('latin-1')
         
-        filename = f"Plant_Health_Report_{results.get('plant_type', 'Unknown')}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf"
         filepath = os.path.join('temp_pdfs', filename)
-        
-        pdf.output(filepath)
+        with open(filepath, 'wb') as f:
+            f.write(pdf_bytes)
+        if report_cache is not None:
+            report_cache.set(cache_key, pdf_bytes)
         
         print(f"✅ PDF saved to: {filepath}")
         
@@ -945,7 +1124,7 @@ def generate_report():
         print(f"❌ PDF generation error: {e}")
         return f"PDF generation failed: {str(e)}", 500
 
-@app.route('/test_disease')
+@route('/test_disease')
 def test_disease():
     """Test disease detection algorithm"""
     test_images = [
@@ -1036,7 +1215,7 @@ def test_disease():
     
     return html
 
-@app.route('/debug_colors')
+@route('/debug_colors')
 def debug_colors():
     """Debug page to test color detection"""
     return '''
@@ -1070,25 +1249,91 @@ def debug_colors():
         </div>
         
         <p>Create these colors in Paint or any image editor, save as JPG, and upload to the app.</p>
+        <p>Flat single-color images are rejected by the quality gate; start the app with QUALITY_GATE=0 to test them.</p>
         <a href="/detect">Go to Detection Page</a> | 
         <a href="/test_disease">View Algorithm Test</a>
     </body>
     </html>
     '''
 
-@app.route('/test')
+@route('/test')
 def test():
     return "✅ Flask is working! Disease detection is improved."
 
-@app.route('/health')
+@route('/health')
 def health():
     return jsonify({
         "status": "running",
         "message": "Plant Disease Detection API",
         "version": "2.0 - Improved Disease Detection",
-        "endpoints": ["/", "/detect", "/test_disease", "/debug_colors", "/test"]
+        "endpoints": ["/", "/detect", "/stream", "/api/v1/capture", "/api/v1/kb", "/history", "/metrics", "/test_disease", "/debug_colors", "/test"]
     })
 
+def create_app(overrides=None):
+    """Build the Flask app: config, directories, stores, classifier backends and routes.
+
+    The stores and caches are per process and bound to this module's globals, so
+    importing app stays cheap and a process serves one app at a time.
+    """
+    global config, history, feature_store, disease_rules, quality_gate, load_monitor, near_duplicates, profiler, knowledge
+    global result_cache, report_cache
+    flask_app = Flask(__name__)
+    flask_app.config.update(default_config())
+    flask_app.config.update(overrides or {})
+    config = flask_app.config
+
+    # PIL's own decompression-bomb check as a backstop for any decode path
+    Image.MAX_IMAGE_PIXELS = config['IMAGE_LIMITS']['max_pixels']
+    init_directories(config)
+
+    knowledge = KnowledgeStore(config['KNOWLEDGE_BASE'])
+    knowledge.current()  # fail at startup, not on the first request, if the file is missing or invalid
+
+    history = HistoryStore(config['HISTORY_DB'])
+    feature_store = FeatureStore(config['FEATURE_STORE'])
+    disease_rules = load_rules_file(config['DISEASE_RULES'])
+
+    quality_gate = QualityGate(config['QUALITY_SETTINGS'])
+    load_monitor = LoadMonitor(config['QOS'])
+    near_duplicates = NearDuplicateIndex(config['PHASH_INDEX_SIZE'], config['PHASH_MAX_DISTANCE'],
+                                         config['PHASH_MAX_KEYS'])
+    profiler = RequestProfiler(config['PROFILING'])
+    result_cache = report_cache = None
+    if config['SHARED_CACHE']['enabled']:
+        try:
+            result_cache = open_shared_cache(config['SHARED_CACHE'], 'results')
+            report_cache = open_shared_cache(config['SHARED_CACHE'], 'reports')
+        except (OSError, ValueError) as e:
+            print(f"⚠️ Shared cache unavailable, continuing without it: {e}")
+
+    register_backend('rules', lambda: RulesBackend(disease_rules))
+    register_backend('model', lambda: ModelBackend(config['MODEL_WEIGHTS']))
+
+    for rule, view, options in ROUTES:
+        flask_app.add_url_rule(rule, view_func=view, **options)
+    if Sock:
+        sock = Sock(flask_app)
+        for rule, view in SOCKET_ROUTES:
+            sock.route(rule)(view)
+    return flask_app
+
+_app = None
+
+def get_app():
+    """The process's default app, created on first use"""
+    global _app
+    if _app is None:
+        _app = create_app()
+    return _app
+
+def __getattr__(name):
+    # `from app import app` and `gunicorn app:app` create the default app on first access
+    if name == 'app':
+        return get_app()
+    if name == 'DISEASE_DATABASE':  # plant -> disease -> info of the current knowledge base
+        return knowledge_base().diseases
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 if __name__ == '__main__':
     print("=" * 50)
     print("🌿 PLANT DISEASE DETECTION APP")
@@ -1100,5 +1345,6 @@ if __name__ == '__main__':
     print("📱 Open: http://localhost:5000")
     print("🔍 Test Algorithm: http://localhost:5000/test_disease")
     print("🎨 Debug Colors: http://localhost:5000/debug_colors")
+    print("🚀 Production: python serve.py --workers 4")
     print("=" * 50)
-    app.run(debug=True, port=5000)
+    get_app().run(debug=True, port=5000)
@@ -0,0 +1,235 @@
+"""Pluggable disease classifiers.
+
+Every backend takes the same inputs: the feature vectors and colour histograms
+produced by features.extract_features, in batches. It returns a symptom code
+and a confidence code per image. Two backends ship:
+
+- "rules": the colour rules in features.DEFAULT_RULES (or calibrated rules)
+- "model": a small neural network run in NumPy on CPU. It is loaded from a
+  local .npz weights file whose layers are stored as int8 with per-column
+  scales, and is trained with `python calibrate.py LABELED_DIR --train-model`
+
+Backends are created, loaded and warmed once per process by get_backend, and
+each one keeps latency statistics so deployments can weigh accuracy against cost.
+"""
+import hashlib
+import io
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+from features import (FEATURE_COLUMNS, HIGH, HIST_BINS, LOW, MEDIUM, SYMPTOMS, VERY_HIGH,
+                      classify_features, rules_digest, rules_for)
+
+_factories = {}
+_backends = {}
+_lock = threading.Lock()
+
+
+def register_backend(name, factory):
+    """Make a backend available under name; factory builds an unloaded instance"""
+    _factories[name] = factory
+    _backends.pop(name, None)
+
+
+def get_backend(name):
+    """The loaded, warmed backend instance for this process"""
+    backend = _backends.get(name)
+    if backend is None:
+        with _lock:
+            backend = _backends.get(name)
+            if backend is None:
+                if name not in _factories:
+                    raise ValueError(f"Unknown classifier backend: {name}")
+                backend = _factories[name]()
+                backend.load()
+                backend.warmup()
+                _backends[name] = backend
+    return backend
+
+
+def backend_stats():
+    """Latency statistics of every registered backend (unloaded ones report loaded: False)"""
+    stats = {}
+    for name in _factories:
+        backend = _backends.get(name)
+        stats[name] = backend.stats() if backend else {'loaded': False}
+    return stats
+
+
+class ClassifierBackend:
+    """Base class: subclasses implement load() and _predict()"""
+
+    name = None
+    fingerprint = None  # digest of the rules or weights content; set by load()
+
+    def __init__(self):
+        self.load_ms = None
+        self._latencies = deque(maxlen=1000)  # per-image milliseconds
+        self._images = 0
+        self._batches = 0
+
+    def load(self):
+        pass
+
+    def warmup(self):
+        self.predict(np.zeros((1, len(FEATURE_COLUMNS)), dtype=np.float32),
+                     np.zeros((1, HIST_BINS), dtype=np.uint8), [''])
+        self._latencies.clear()
+        self._images = self._batches = 0
+
+    def predict(self, features, hists, plant_types):
+        """Symptom codes and confidence codes for a batch of images"""
+        started = time.perf_counter()
+        symptoms, confidences = self._predict(np.asarray(features, dtype=np.float32),
+                                              np.asarray(hists), list(plant_types))
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        self._latencies.append(elapsed_ms / max(len(plant_types), 1))
+        self._images += len(plant_types)
+        self._batches += 1
+        return symptoms, confidences
+
+    def _predict(self, features, hists, plant_types):
+        raise NotImplementedError
+
+    def stats(self):
+        latencies = np.array(self._latencies) if self._latencies else np.zeros(1)
+        return {
+            'loaded': True,
+            'load_ms': self.load_ms,
+            'images': self._images,
+            'batches': self._batches,
+            'latency_ms_per_image': {
+                'mean': round(float(latencies.mean()), 4),
+                'p50': round(float(np.percentile(latencies, 50)), 4),
+                'p95': round(float(np.percentile(latencies, 95)), 4)
+            }
+        }
+
+
+class RulesBackend(ClassifierBackend):
+    """The colour heuristics, optionally with per-plant calibrated rules"""
+
+    name = 'rules'
+
+    def __init__(self, rules):
+        super().__init__()
+        self.rules = rules
+
+    def load(self):
+        self.fingerprint = rules_digest(self.rules)
+
+    def _predict(self, features, hists, plant_types):
+        if 'thresholds' in self.rules:
+            _, symptoms, confidences = classify_features(features, self.rules)
+            return symptoms, confidences
+        symptoms = np.zeros(len(features), dtype=np.int64)
+        confidences = np.zeros(len(features), dtype=np.int64)
+        plants = np.array(plant_types)
+        for plant_type in set(plant_types):
+            rows = plants == plant_type
+            _, symptoms[rows], confidences[rows] = classify_features(
+                features[rows], rules_for(self.rules, plant_type))
+        return symptoms, confidences
+
+
+def model_inputs(features, hists):
+    """Network input: the feature vector followed by the histogram as pixel fractions"""
+    return np.concatenate([features, hists.astype(np.float32) / 255.0], axis=1)
+
+
+def confidence_codes(probabilities):
+    return np.select([probabilities >= 0.9, probabilities >= 0.75, probabilities >= 0.5],
+                     [VERY_HIGH, HIGH, MEDIUM], LOW)
+
+
+class ModelBackend(ClassifierBackend):
+    """Two-layer MLP over the shared features, int8 weights dequantized once at load"""
+
+    name = 'model'
+
+    def __init__(self, weights_path):
+        super().__init__()
+        self.weights_path = weights_path
+
+    def load(self):
+        if not self.weights_path:
+            raise ValueError("MODEL_WEIGHTS is not set")
+        started = time.perf_counter()
+        with open(self.weights_path, 'rb') as f:
+            raw = f.read()
+        self.fingerprint = hashlib.sha256(raw).hexdigest()[:16]
+        with np.load(io.BytesIO(raw)) as weights:
+            self.mean = weights['mean'].astype(np.float32)
+            self.std = weights['std'].astype(np.float32)
+            self.layers = [
+                (weights[f'w{i}_q'].astype(np.float32) * weights[f'w{i}_scale'], weights[f'b{i}'])
+                for i in range(int(weights['n_layers']))
+            ]
+            classes = [str(c) for c in weights['classes']]
+        if len(self.mean) != len(FEATURE_COLUMNS) + HIST_BINS:
+            raise ValueError(f"{self.weights_path} was trained on a different feature set; "
+                             "retrain it with calibrate.py --train-model")
+        self.class_symptoms = np.array([SYMPTOMS.index(c) for c in classes])
+        self.load_ms = round((time.perf_counter() - started) * 1000, 2)
+
+    def _predict(self, features, hists, plant_types):
+        x = (model_inputs(features, hists) - self.mean) / self.std
+        for i, (weight, bias) in enumerate(self.layers):
+            x = x @ weight + bias
+            if i < len(self.layers) - 1:
+                np.maximum(x, 0, out=x)
+        x -= x.max(axis=1, keepdims=True)
+        probabilities = np.exp(x)
+        probabilities /= probabilities.sum(axis=1, keepdims=True)
+        best = probabilities.argmax(axis=1)
+        return self.class_symptoms[best], confidence_codes(probabilities[np.arange(len(best)), best])
+
+
+def quantize(weight):
+    """int8 weights plus a float32 scale per output column"""
+    scale = np.abs(weight).max(axis=0) / 127.0
+    scale[scale == 0] = 1.0
+    return np.round(weight / scale).astype(np.int8), scale.astype(np.float32)
+
+
+def train_model(features, hists, symptoms, path, hidden=32, epochs=500, learning_rate=0.05, seed=0):
+    """Fit the MLP on symptom labels with full-batch gradient descent and save quantized weights"""
+    rng = np.random.default_rng(seed)
+    x = model_inputs(features.astype(np.float32), hists)
+    mean, std = x.mean(axis=0), x.std(axis=0) + 1e-6
+    x = (x - mean) / std
+
+    classes = sorted(set(symptoms))
+    y = np.array([classes.index(s) for s in symptoms])
+    onehot = np.eye(len(classes), dtype=np.float32)[y]
+
+    sizes = [x.shape[1], hidden, len(classes)]
+    weights = [rng.normal(0, np.sqrt(2 / sizes[i]), (sizes[i], sizes[i + 1])).astype(np.float32)
+               for i in range(len(sizes) - 1)]
+    biases = [np.zeros(size, dtype=np.float32) for size in sizes[1:]]
+
+    for _ in range(epochs):
+        h = np.maximum(x @ weights[0] + biases[0], 0)
+        logits = h @ weights[1] + biases[1]
+        logits -= logits.max(axis=1, keepdims=True)
+        p = np.exp(logits)
+        p /= p.sum(axis=1, keepdims=True)
+
+        grad_logits = (p - onehot) / len(x)
+        grad_h = (grad_logits @ weights[1].T) * (h > 0)
+        weights[1] -= learning_rate * h.T @ grad_logits
+        biases[1] -= learning_rate * grad_logits.sum(axis=0)
+        weights[0] -= learning_rate * x.T @ grad_h
+        biases[0] -= learning_rate * grad_h.sum(axis=0)
+
+    arrays = {'n_layers': len(weights), 'mean': mean, 'std': std, 'classes': np.array(classes)}
+    for i, (weight, bias) in enumerate(zip(weights, biases)):
+        arrays[f'w{i}_q'], arrays[f'w{i}_scale'] = quantize(weight)
+        arrays[f'b{i}'] = bias
+    np.savez(path, **arrays)
+
+    predicted = np.maximum(x @ weights[0] + biases[0], 0) @ weights[1] + biases[1]
+    return float((predicted.argmax(axis=1) == y).mean())
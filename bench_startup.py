@@ -0,0 +1,74 @@
+"""Cold-start benchmark: import time, app creation and first response.
+
+Usage:
+    python bench_startup.py              # median of 5 fresh interpreters
+    python bench_startup.py --runs 10 --top 25
+
+Every run starts a new interpreter, so nothing is cached in-process. It
+reports the time to import app, to create the app (directories, stores,
+routes) and to answer the first request, followed by the slowest imports
+from `python -X importtime -c "import app"`.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+PROBE = '''
+import json, os, time
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+flask_app = app.create_app({'HISTORY_DB': os.path.join(os.environ['BENCH_DIR'], 'history.db'),
+                            'FEATURE_STORE': os.path.join(os.environ['BENCH_DIR'], 'features')})
+created = time.perf_counter()
+flask_app.test_client().get('/health')
+served = time.perf_counter()
+print(json.dumps({'import_ms': (imported - started) * 1000, 'create_app_ms': (created - imported) * 1000,
+                  'first_request_ms': (served - created) * 1000, 'total_ms': (served - started) * 1000}))
+'''
+
+
+def run_probe(work_dir):
+    env = dict(os.environ, BENCH_DIR=work_dir)
+    output = subprocess.run([sys.executable, '-c', PROBE], capture_output=True, text=True, check=True, env=env)
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+
+def import_times(top):
+    """(cumulative ms, self ms, module) of the slowest imports under app"""
+    output = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import app'],
+                            capture_output=True, text=True, check=True)
+    rows = []
+    for line in output.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative_us, module = line[len('import time:'):].split('|')
+        rows.append((int(cumulative_us) / 1000, int(self_us) / 1000, module.rstrip()))
+    return sorted(rows, reverse=True)[:top]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Measure cold-start time of the app')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=15, help='Slowest imports to list')
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        runs = [run_probe(work_dir) for _ in range(args.runs)]
+
+    print(f"⏱️ Cold start, median of {args.runs} fresh interpreters:")
+    for key in ('import_ms', 'create_app_ms', 'first_request_ms', 'total_ms'):
+        print(f"   {key:<18}{statistics.median(run[key] for run in runs):8.1f} ms")
+
+    print("\n📦 Slowest imports (python -X importtime -c 'import app'):")
+    print(f"   {'cumulative':>10} {'self':>8}  module")
+    for cumulative, own, module in import_times(args.top):
+        print(f"   {cumulative:8.1f}ms {own:6.1f}ms  {module}")
+
+
+if __name__ == '__main__':
+    main()
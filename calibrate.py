@@ -0,0 +1,264 @@
+"""Threshold calibration over a labeled set of leaf images.
+
+Usage:
+    python calibrate.py LABELED_DIR --out rules.json
+    python calibrate.py LABELED_DIR --plant Tomato --workers 8
+
+LABELED_DIR holds <Plant>/<Label>/image.jpg (or just <Label>/image.jpg with
+--plant), where the label is "Healthy" or the disease name.
+
+Features are extracted once, in parallel. Every combination of the rule
+thresholds in the search grid is then scored against every image with one
+broadcast NumPy evaluation, first for healthy/diseased (thresholds plus the
+diseased score band), then for the disease name (the high/very high bands).
+The best rules per plant are written as JSON that `DISEASE_RULES` and
+`python features.py rescore --rules` accept.
+
+With --train-model, the same features also train the NumPy model backend
+(see backends.py) and its quantized weights are saved for MODEL_WEIGHTS.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import time
+
+import numpy as np
+from PIL import Image
+
+from backends import train_model
+from features import (COLUMN, DEFAULT_RULES, HIST_BINS, SYMPTOMS, classify_features,
+                      extract_features, merge_rules, rule_points)
+from knowledge import KNOWLEDGE_BASE_PATH, load_knowledge_base
+
+# Search grid for each threshold, centred on the hand-picked defaults
+THRESHOLD_GRID = {
+    'low_green': np.linspace(0.22, 0.38, 9),
+    'high_red': np.linspace(0.32, 0.48, 9),
+    'high_variation': np.linspace(30, 70, 9),
+    'low_brightness': np.linspace(80, 160, 9),
+    'low_blue': np.linspace(0.12, 0.28, 9)
+}
+FEATURE_FOR = {
+    'low_green': ('green_ratio', np.less),
+    'high_red': ('red_ratio', np.greater),
+    'high_variation': ('green_std', np.greater),
+    'low_brightness': ('brightness', np.less),
+    'low_blue': ('blue_ratio', np.less)
+}
+MEDIUM_BANDS = np.arange(1, 9)
+CHUNK_BYTES = 64 * 1024 * 1024
+
+
+def find_labeled_images(root, plant=None):
+    """(path, plant_type, label) for every image under the labeled folder layout"""
+    samples = []
+    plant_dirs = [(plant, root)] if plant else [
+        (name, os.path.join(root, name)) for name in sorted(os.listdir(root))
+        if os.path.isdir(os.path.join(root, name))
+    ]
+    for plant_type, plant_dir in plant_dirs:
+        for label in sorted(os.listdir(plant_dir)):
+            label_dir = os.path.join(plant_dir, label)
+            if not os.path.isdir(label_dir):
+                continue
+            for dirpath, _, filenames in os.walk(label_dir):
+                for filename in sorted(filenames):
+                    if filename.lower().endswith(('.png', '.jpg', '.jpeg')):
+                        samples.append((os.path.join(dirpath, filename), plant_type, label))
+    return samples
+
+
+def _extract(path):
+    try:
+        with Image.open(path) as img:
+            return extract_features(np.asarray(img.convert('RGB')))
+    except Exception as e:
+        print(f"❌ Skipping {path}: {e}")
+        return None
+
+
+def extract_all(paths, workers=None):
+    """Feature matrix and histograms for all paths (feature rows of unreadable images are NaN)"""
+    with multiprocessing.Pool(workers) as pool:
+        extracted = pool.map(_extract, paths, chunksize=32)
+    matrix = np.full((len(paths), len(COLUMN)), np.nan, dtype=np.float32)
+    hists = np.zeros((len(paths), HIST_BINS), dtype=np.uint8)
+    for i, result in enumerate(extracted):
+        if result is not None:
+            matrix[i], hists[i] = result
+    return matrix, hists
+
+
+def grid_search_thresholds(features, diseased, rules):
+    """Best thresholds + diseased band by balanced accuracy, evaluated over the full grid at once.
+
+    Each rule's indicator is computed per grid value, shaped so that summing them
+    broadcasts to one score array per (threshold combination, image).
+    """
+    names = list(THRESHOLD_GRID)
+    points = rules['points']
+    n_axes = len(names)
+
+    # Rules outside the grid (red over green, lesions, chlorosis) keep their current thresholds
+    fixed = sum(hit for name, hit in rule_points(features, rules).items() if name not in THRESHOLD_GRID)
+    tp = np.zeros([len(THRESHOLD_GRID[n]) for n in names] + [len(MEDIUM_BANDS)], dtype=np.int64)
+    fp = np.zeros_like(tp)
+
+    grid_size = int(np.prod(tp.shape[:-1]))
+    chunk = max(1, CHUNK_BYTES // grid_size)
+    for start in range(0, len(features), chunk):
+        rows = slice(start, start + chunk)
+        score = fixed[rows].astype(np.int8)
+        for axis, name in enumerate(names):
+            column, compare = FEATURE_FOR[name]
+            values = features[rows, COLUMN[column]]
+            hit = compare(values[None, :], THRESHOLD_GRID[name][:, None]).astype(np.int8) * points[name]
+            shape = [1] * n_axes + [hit.shape[1]]
+            shape[axis] = hit.shape[0]
+            score = score + hit.reshape(shape)
+        labels = diseased[rows]
+        for b, band in enumerate(MEDIUM_BANDS):
+            predicted = score >= band
+            tp[..., b] += (predicted & labels).sum(axis=-1)
+            fp[..., b] += (predicted & ~labels).sum(axis=-1)
+
+    positives = max(int(diseased.sum()), 1)
+    negatives = max(int((~diseased).sum()), 1)
+    balanced_accuracy = (tp / positives + (negatives - fp) / negatives) / 2
+    best = np.unravel_index(np.argmax(balanced_accuracy), balanced_accuracy.shape)
+
+    thresholds = {name: round(float(THRESHOLD_GRID[name][best[i]]), 3) for i, name in enumerate(names)}
+    return thresholds, int(MEDIUM_BANDS[best[-1]]), float(balanced_accuracy[best]), grid_size * len(MEDIUM_BANDS)
+
+
+def disease_names(plant_type, disease_for):
+    """Disease name for each symptom code of a plant"""
+    return np.array([disease_for(plant_type, symptom) if symptom != 'Healthy' else 'Healthy'
+                     for symptom in SYMPTOMS])
+
+
+def search_upper_bands(features, labels, plant_type, rules, disease_for):
+    """Best (high, very_high) bands for disease-name accuracy with thresholds already chosen"""
+    names = disease_names(plant_type, disease_for)
+    best = (rules['bands']['high'], rules['bands']['very_high'])
+    best_accuracy = -1.0
+    for high in range(rules['bands']['medium'], 11):
+        for very_high in range(high, 11):
+            trial = merge_rules({**rules, 'bands': {**rules['bands'], 'high': high, 'very_high': very_high}})
+            _, symptom, _ = classify_features(features, trial)
+            accuracy = float((names[symptom] == labels).mean())
+            if accuracy > best_accuracy:
+                best, best_accuracy = (high, very_high), accuracy
+    return best, best_accuracy
+
+
+def confusion_matrix(actual, predicted):
+    classes = sorted(set(actual) | set(predicted))
+    index = {name: i for i, name in enumerate(classes)}
+    matrix = np.zeros((len(classes), len(classes)), dtype=np.int64)
+    np.add.at(matrix, (np.vectorize(index.get)(actual), np.vectorize(index.get)(predicted)), 1)
+    return classes, matrix
+
+
+def print_confusion(title, classes, matrix):
+    width = max(len(c) for c in classes + ['actual \\ predicted'])
+    print(f"\n   {title}")
+    print('   ' + 'actual \\ predicted'.ljust(width) + ''.join(c[:14].rjust(16) for c in classes))
+    for name, row in zip(classes, matrix):
+        print('   ' + name.ljust(width) + ''.join(str(n).rjust(16) for n in row))
+
+
+def symptom_label(plant_type, label, disease_for):
+    """Symptom type whose plant-specific disease is the label (the model's training target)"""
+    if label.lower() == 'healthy':
+        return 'Healthy'
+    for symptom in SYMPTOMS[1:]:
+        if disease_for(plant_type, symptom) == label:
+            return symptom
+    return None
+
+
+def calibrate(root, plant=None, workers=None, model_path=None):
+    """Calibrate rules per plant type; returns {plant_type: rules overrides}"""
+    samples = find_labeled_images(root, plant)
+    if not samples:
+        raise SystemExit(f"No labeled images found under {root}")
+    disease_for = load_knowledge_base(os.environ.get('KNOWLEDGE_BASE', KNOWLEDGE_BASE_PATH)).disease_for
+
+    started = time.perf_counter()
+    features, hists = extract_all([path for path, _, _ in samples], workers)
+    extract_seconds = time.perf_counter() - started
+    print(f"📥 Extracted features of {len(samples)} images in {extract_seconds:.1f}s")
+
+    plants = np.array([plant_type for _, plant_type, _ in samples])
+    labels = np.array([label for _, _, label in samples])
+    valid = ~np.isnan(features).any(axis=1)
+    calibrated = {}
+
+    for plant_type in sorted(set(plants)):
+        rows = (plants == plant_type) & valid
+        plant_features, plant_labels = features[rows], labels[rows]
+        diseased = np.char.lower(plant_labels.astype(str)) != 'healthy'
+        plant_labels = np.where(diseased, plant_labels, 'Healthy')
+
+        started = time.perf_counter()
+        thresholds, medium, balanced_accuracy, evaluated = grid_search_thresholds(
+            plant_features, diseased, DEFAULT_RULES)
+        rules = merge_rules({'thresholds': thresholds, 'bands': {'medium': medium}})
+        rules['bands']['high'] = max(rules['bands']['high'], medium)
+        rules['bands']['very_high'] = max(rules['bands']['very_high'], rules['bands']['high'])
+        (high, very_high), name_accuracy = search_upper_bands(
+            plant_features, plant_labels, plant_type, rules, disease_for)
+        rules['bands'].update({'high': high, 'very_high': very_high})
+        search_seconds = time.perf_counter() - started
+
+        _, before_symptom, _ = classify_features(plant_features, DEFAULT_RULES)
+        _, after_symptom, _ = classify_features(plant_features, rules)
+        status = np.where(diseased, 'DISEASED', 'HEALTHY')
+
+        print(f"\n🌿 {plant_type}: {len(plant_features)} images, "
+              f"{evaluated:,} rule combinations in {search_seconds:.2f}s")
+        print(f"   Balanced accuracy (healthy/diseased): {balanced_accuracy:.3f}, "
+              f"disease name accuracy: {name_accuracy:.3f}")
+        print(f"   Thresholds: {rules['thresholds']}")
+        print(f"   Bands: {rules['bands']}")
+        print_confusion('Default rules', *confusion_matrix(
+            status, np.where(before_symptom == 0, 'HEALTHY', 'DISEASED')))
+        print_confusion('Calibrated rules', *confusion_matrix(
+            status, np.where(after_symptom == 0, 'HEALTHY', 'DISEASED')))
+        names = disease_names(plant_type, disease_for)
+        print_confusion('Calibrated rules by disease', *confusion_matrix(plant_labels, names[after_symptom]))
+
+        calibrated[plant_type] = {'thresholds': rules['thresholds'], 'bands': rules['bands']}
+
+    if model_path:
+        targets = np.array([symptom_label(plant_type, label, disease_for) if ok else None
+                            for (_, plant_type, label), ok in zip(samples, valid)])
+        usable = targets != None  # noqa: E711 - elementwise comparison
+        started = time.perf_counter()
+        accuracy = train_model(features[usable], hists[usable], list(targets[usable]), model_path)
+        print(f"\n🧠 Model trained on {int(usable.sum())} images in {time.perf_counter() - started:.1f}s, "
+              f"training accuracy {accuracy:.3f}; weights saved to {model_path}")
+
+    return calibrated
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Calibrate disease rule thresholds on labeled images')
+    parser.add_argument('root', help='Labeled image folder: <Plant>/<Label>/image.jpg')
+    parser.add_argument('--plant', help='Treat root as <Label>/image.jpg for this one plant type')
+    parser.add_argument('--workers', type=int, default=None, help='Feature extraction processes')
+    parser.add_argument('--out', help='Write calibrated rules per plant type to this JSON file')
+    parser.add_argument('--train-model', metavar='WEIGHTS.npz', help='Also train the model backend and save its weights')
+    args = parser.parse_args(argv)
+
+    calibrated = calibrate(args.root, plant=args.plant, workers=args.workers, model_path=args.train_model)
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            json.dump(calibrated, f, indent=2)
+        print(f"\n✅ Rules written to {args.out}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+"""Lookup-table colour classes and vegetation indices.
+
+Per-pixel HSV or vegetation-index maths in float costs several float arrays
+the size of the image. Instead every pixel is quantized to 5 bits per channel
+with integer shifts, giving a 15-bit colour code. Hue, saturation, pixel
+class (background, healthy leaf, chlorotic, lesion) and the ExG and VARI
+vegetation indices are precomputed once for each of the 32768 codes. Summary
+features of a whole image then only need a histogram of its colour codes,
+and a per-pixel class map is a single table lookup.
+"""
+import numpy as np
+
+QUANT_BITS = 5
+LEVELS = 1 << QUANT_BITS   # per channel
+CODES = LEVELS ** 3        # 32768 colour codes
+
+BACKGROUND, LEAF, CHLOROSIS, LESION = range(4)
+CLASS_NAMES = ['background', 'leaf', 'chlorosis', 'lesion']
+
+COLOR_COLUMNS = ['leaf_fraction', 'lesion_fraction', 'chlorosis_fraction', 'exg', 'vari']
+
+# Hue in degrees, saturation and value in 0-1
+LEAF_HUE = (70, 170)       # green tissue
+CHLOROSIS_HUE = (45, 70)   # yellowing tissue
+LESION_HUE = (0, 45)       # brown / necrotic tissue (reddish hues wrap around 360)
+MIN_SATURATION = 0.18
+MIN_VALUE = 0.10
+MIN_CHLOROSIS_VALUE = 0.35
+MAX_LESION_VALUE = 0.80
+
+
+def _tables():
+    """Hue bin, saturation bin, class, ExG, VARI and RGB (0-255) of the centre colour of every code"""
+    levels = (np.arange(LEVELS) << (8 - QUANT_BITS)) + (1 << (7 - QUANT_BITS))
+    r, g, b = [c.ravel().astype(np.float64) / 255 for c in
+               np.meshgrid(levels, levels, levels, indexing='ij')]
+
+    high = np.maximum(np.maximum(r, g), b)
+    low = np.minimum(np.minimum(r, g), b)
+    chroma = high - low
+    safe = np.where(chroma > 0, chroma, 1)
+    hue = np.select([chroma == 0, high == r, high == g],
+                    [0, ((g - b) / safe) % 6, (b - r) / safe + 2],
+                    (r - g) / safe + 4) * 60
+    saturation = np.where(high > 0, chroma / np.where(high > 0, high, 1), 0)
+
+    colored = (saturation >= MIN_SATURATION) & (high >= MIN_VALUE)
+    classes = np.select(
+        [colored & (hue >= LEAF_HUE[0]) & (hue < LEAF_HUE[1]),
+         colored & (hue >= CHLOROSIS_HUE[0]) & (hue < CHLOROSIS_HUE[1]) & (high >= MIN_CHLOROSIS_VALUE),
+         colored & ((hue < LESION_HUE[1]) | (hue >= 340)) & (high <= MAX_LESION_VALUE)],
+        [LEAF, CHLOROSIS, LESION],
+        BACKGROUND
+    ).astype(np.uint8)
+
+    total = r + g + b
+    exg = np.where(total > 0, (2 * g - r - b) / np.where(total > 0, total, 1), 0)
+    denominator = g + r - b
+    vari = np.clip(np.where(np.abs(denominator) > 1e-3,
+                            (g - r) / np.where(np.abs(denominator) > 1e-3, denominator, 1), 0), -1, 1)
+
+    hue_bins = np.round(hue / 2).astype(np.uint8) % 180   # OpenCV-style 0-179
+    saturation_bins = np.round(saturation * 255).astype(np.uint8)
+    rgb = np.stack([r, g, b], axis=-1) * 255
+    return hue_bins, saturation_bins, classes, exg.astype(np.float32), vari.astype(np.float32), rgb
+
+
+HUE_LUT, SATURATION_LUT, CLASS_LUT, EXG_LUT, VARI_LUT, CODE_RGB = _tables()
+
+# Per code: one column per class, then ExG and VARI on leaf codes only, so the
+# sums color_features needs are one matrix product with the code histogram
+COLOR_WEIGHTS = np.concatenate([
+    (CLASS_LUT[:, None] == np.arange(len(CLASS_NAMES))).astype(np.float64),
+    np.where(CLASS_LUT != BACKGROUND, EXG_LUT, 0)[:, None].astype(np.float64),
+    np.where(CLASS_LUT != BACKGROUND, VARI_LUT, 0)[:, None].astype(np.float64)
+], axis=1)
+
+
+# Per code: mean RGB of the pixels it covers (the centre sits half a level high),
+# squared RGB, then the colour weights, so all per-block sums grid.py needs are
+# one product with a block's code histogram
+_BLOCK_RGB = CODE_RGB - 0.5
+BLOCK_WEIGHTS = np.concatenate([_BLOCK_RGB, _BLOCK_RGB ** 2, COLOR_WEIGHTS], axis=1)
+
+
+def color_codes(pixels):
+    """15-bit colour code of each (..., 3) uint8 pixel: the top 5 bits of each channel"""
+    q = pixels[..., :3] >> (8 - QUANT_BITS)
+    return ((q[..., 0].astype(np.uint16) << (2 * QUANT_BITS))
+            | (q[..., 1].astype(np.uint16) << QUANT_BITS) | q[..., 2])
+
+
+def code_counts(pixels):
+    """Histogram of the colour codes of (..., 3) uint8 pixels"""
+    return np.bincount(color_codes(pixels).ravel(), minlength=CODES)
+
+
+def pixel_classes(img_array):
+    """Class of each pixel (BACKGROUND, LEAF, CHLOROSIS or LESION) of an RGB uint8 array"""
+    return CLASS_LUT[color_codes(img_array)]
+
+
+def leaf_mask(img_array):
+    """True where a pixel is leaf tissue, healthy or not"""
+    return pixel_classes(img_array) != BACKGROUND
+
+
+def color_features(counts):
+    """COLOR_COLUMNS values from a colour-code histogram (or a stack of them)"""
+    return color_features_from_sums(np.asarray(counts, dtype=np.float64) @ COLOR_WEIGHTS)
+
+
+def color_features_from_sums(sums):
+    """COLOR_COLUMNS values from colour-code histograms already multiplied by COLOR_WEIGHTS"""
+    per_class = sums[..., :len(CLASS_NAMES)]
+    pixels = per_class.sum(axis=-1)
+    leaf = per_class[..., LEAF] + per_class[..., CHLOROSIS] + per_class[..., LESION]
+    safe_leaf = np.where(leaf > 0, leaf, 1)
+    return np.stack([
+        leaf / np.where(pixels > 0, pixels, 1),
+        per_class[..., LESION] / safe_leaf,
+        per_class[..., CHLOROSIS] / safe_leaf,
+        sums[..., -2] / safe_leaf,
+        sums[..., -1] / safe_leaf
+    ], axis=-1).astype(np.float32)
+
+
+def hue_saturation_histogram(counts, hue_bins=18, saturation_bins=4):
+    """Pixel fractions per (hue, saturation) bin from a colour-code histogram"""
+    hue = HUE_LUT.astype(np.intp) * hue_bins // 180
+    saturation = SATURATION_LUT.astype(np.intp) * saturation_bins // 256
+    hist = np.bincount(hue * saturation_bins + saturation, weights=counts,
+                       minlength=hue_bins * saturation_bins)
+    return (hist / max(hist.sum(), 1)).reshape(hue_bins, saturation_bins)
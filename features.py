@@ -0,0 +1,394 @@
+"""Colour features and disease scoring rules, plus an on-disk feature store.
+
+`extract_features` turns an RGB pixel array into the numbers the disease rules
+look at: channel statistics plus the leaf, lesion and chlorosis fractions and
+vegetation indices from colorspace's lookup tables. The rules themselves (`DEFAULT_RULES`) are plain data and are applied
+with NumPy array operations, so the same code scores one image during a
+request or a million stored feature vectors in one pass.
+
+Every analysed image's features are appended to a FeatureStore: fixed-size
+binary records, one shard file per process, read back as a memory-mapped
+NumPy array. Re-score the archive with a new rule set:
+    python features.py rescore --rules new_rules.json
+"""
+import argparse
+import copy
+import glob
+import hashlib
+import json
+import os
+import socket
+import threading
+import time
+
+import numpy as np
+
+from colorspace import BLOCK_WEIGHTS, CODES, COLOR_COLUMNS, LEVELS, code_counts, color_codes, color_features
+
+CHANNEL_COLUMNS = [
+    'red_mean', 'green_mean', 'blue_mean',
+    'red_std', 'green_std', 'blue_std',
+    'red_ratio', 'green_ratio', 'blue_ratio',
+    'brightness'
+]
+FEATURE_COLUMNS = CHANNEL_COLUMNS + COLOR_COLUMNS
+COLUMN = {name: i for i, name in enumerate(FEATURE_COLUMNS)}
+
+HIST_LEVELS = 4  # per channel, so the colour histogram has 4 * 4 * 4 = 64 bins
+HIST_BINS = HIST_LEVELS ** 3
+
+DEFAULT_RULES = {
+    'thresholds': {
+        'low_green': 0.30,       # green_ratio below
+        'high_red': 0.40,        # red_ratio above
+        'high_variation': 50,    # green_std above
+        'low_brightness': 120,   # brightness below
+        'low_blue': 0.20,        # blue_ratio below
+        'lesions': 0.08,         # lesion_fraction above
+        'chlorosis': 0.20,       # chlorosis_fraction above
+        'borderline_green': 0.32
+    },
+    'points': {
+        'low_green': 3,
+        'high_red': 2,
+        'red_over_green': 2,
+        'high_variation': 1,
+        'low_brightness': 1,
+        'low_blue': 1,
+        'lesions': 2,
+        'chlorosis': 1
+    },
+    'bands': {
+        'very_high': 6,
+        'high': 4,
+        'medium': 2
+    }
+}
+
+# Symptom codes map onto get_plant_specific_disease() symptom types
+SYMPTOMS = ['Healthy', 'red_dominant', 'low_green', 'early_signs']
+HEALTHY, RED_DOMINANT, LOW_GREEN, EARLY_SIGNS = range(len(SYMPTOMS))
+CONFIDENCES = ['Low', 'Medium', 'High', 'Very High']
+LOW, MEDIUM, HIGH, VERY_HIGH = range(len(CONFIDENCES))
+
+
+def extract_features(img_array, block_pixels=1 << 20, block_sums=None):
+    """Feature vector and colour histogram of an RGB uint8 array.
+
+    Channel means and standard deviations come from exact per-channel value
+    histograms, and the colour features and histogram from a histogram of
+    15-bit colour codes, all accumulated over blocks of rows, so memory stays
+    at one block however large the image is.
+
+    block_sums, a (K, K, BLOCK_WEIGHTS columns) float array, is filled with the
+    sums of colorspace.BLOCK_WEIGHTS over the pixels of each block of a K x K
+    grid over the image (see grid.py). The rows are then processed one grid row
+    at a time. Each grid row is viewed as (rows, K, block width) without copying
+    and histogrammed per block: over all codes for large rows (their sum is the
+    image histogram for that row), or over only the codes present in the row for
+    small ones. The sums are then one product with BLOCK_WEIGHTS of the codes
+    used. The last height % K rows and width % K columns are counted only in the
+    image totals.
+    """
+    height, width = img_array.shape[:2]
+    value_counts = np.zeros((3, 256), dtype=np.int64)
+    codes = np.zeros(LEVELS ** 3, dtype=np.int64)
+    if block_sums is None:
+        rows = max(1, block_pixels // max(width, 1))
+        bands = [(start, start + rows) for start in range(0, height, rows)]
+    else:
+        grid = block_sums.shape[0]
+        remap = np.empty(CODES, dtype=np.intp)
+        block_height, block_width = height // grid, width // grid
+        if not block_height or not block_width:
+            raise ValueError(f"Image of {width}x{height} is too small for a {grid}x{grid} grid")
+        bands = [(i * block_height, (i + 1) * block_height) for i in range(grid)]
+        if height > grid * block_height:
+            bands.append((grid * block_height, height))
+    for band, (start, stop) in enumerate(bands):
+        block = img_array[start:stop, :, :3]
+        pixels = block.reshape(-1, 3)
+        for c in range(3):
+            value_counts[c] += np.bincount(pixels[:, c], minlength=256)
+        if block_sums is None or band == grid:
+            codes += code_counts(pixels)
+            continue
+        band_codes = color_codes(block)
+        # One grid row as (rows, K, block width) without copying
+        blocks = band_codes[:, :grid * block_width].reshape(stop - start, grid, block_width)
+        if blocks.size >= grid * CODES:
+            # Large rows: a full code histogram per block, summed for the image
+            counts = np.stack([np.bincount(blocks[:, j].ravel(), minlength=CODES) for j in range(grid)])
+            band_counts = counts.sum(axis=0)
+            if width > grid * block_width:
+                band_counts += np.bincount(band_codes[:, grid * block_width:].ravel(), minlength=CODES)
+            used = np.flatnonzero(band_counts)
+            counts = counts[:, used]
+        else:
+            # Small rows: histograms that big cost more than the pixels; count only the codes present
+            band_counts = np.bincount(band_codes.ravel(), minlength=CODES)
+            used = np.flatnonzero(band_counts)
+            remap[used] = np.arange(len(used))
+            ids = remap[blocks]
+            ids += (np.arange(grid) * len(used))[:, None]
+            counts = np.bincount(ids.ravel(), minlength=grid * len(used)).reshape(grid, len(used))
+        codes += band_counts
+        block_sums[band] = counts @ BLOCK_WEIGHTS[used]
+
+    pixel_count = max(height * width, 1)
+    values = np.arange(256, dtype=np.float64)
+    means = value_counts @ values / pixel_count
+    stds = np.sqrt((value_counts * (values - means[:, None]) ** 2).sum(axis=1) / pixel_count)
+
+    total_color = means.sum()
+    ratios = means / total_color if total_color > 0 else np.zeros(3)
+    brightness = total_color / 3
+
+    vector = np.array([*means, *stds, *ratios, brightness, *color_features(codes)], dtype=np.float32)
+    hist = np.round(coarse_histogram(codes) * 255.0 / pixel_count).astype(np.uint8)
+    return vector, hist
+
+
+def coarse_histogram(codes):
+    """Fold a colour-code histogram into HIST_BINS bins: the top 2 bits of each channel"""
+    fold = LEVELS // HIST_LEVELS
+    return codes.reshape(HIST_LEVELS, fold, HIST_LEVELS, fold, HIST_LEVELS, fold).sum(axis=(1, 3, 5)).ravel()
+
+
+def merge_rules(overrides=None):
+    """DEFAULT_RULES with any thresholds/points/bands from overrides replaced"""
+    rules = copy.deepcopy(DEFAULT_RULES)
+    for section, values in (overrides or {}).items():
+        if section not in rules:
+            raise ValueError(f"Unknown rules section: {section}")
+        unknown = set(values) - set(rules[section])
+        if unknown:
+            raise ValueError(f"Unknown {section}: {', '.join(sorted(unknown))}")
+        rules[section].update(values)
+    return rules
+
+
+def resolve_rules(overrides=None):
+    """One rule set, or {plant_type: rule set} when the overrides are keyed by plant type"""
+    overrides = overrides or {}
+    if all(section in DEFAULT_RULES for section in overrides):
+        return merge_rules(overrides)
+    return {plant_type: merge_rules(plant_overrides) for plant_type, plant_overrides in overrides.items()}
+
+
+def load_rules_file(path):
+    """Rules from a JSON file as written by calibrate.py (None or a missing path gives the defaults)"""
+    if not path:
+        return DEFAULT_RULES
+    with open(path, 'r', encoding='utf-8') as f:
+        return resolve_rules(json.load(f))
+
+
+def rules_digest(rules):
+    """Short content hash of a (merged) rule set, for cache keys"""
+    return hashlib.sha256(json.dumps(rules, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+
+
+def rules_for(rules, plant_type):
+    """The rule set that applies to a plant type"""
+    if 'thresholds' in rules:
+        return rules
+    return rules.get(plant_type, DEFAULT_RULES)
+
+
+def rule_points(features, rules=DEFAULT_RULES):
+    """Points each rule adds; works on one feature vector or a matrix of them"""
+    features = np.asarray(features)
+    t, p = rules['thresholds'], rules['points']
+    green = features[..., COLUMN['green_ratio']]
+    red = features[..., COLUMN['red_ratio']]
+    return {
+        'low_green': (green < t['low_green']) * p['low_green'],
+        'high_red': (red > t['high_red']) * p['high_red'],
+        'red_over_green': (red > green) * p['red_over_green'],
+        'high_variation': (features[..., COLUMN['green_std']] > t['high_variation']) * p['high_variation'],
+        'low_brightness': (features[..., COLUMN['brightness']] < t['low_brightness']) * p['low_brightness'],
+        'low_blue': (features[..., COLUMN['blue_ratio']] < t['low_blue']) * p['low_blue'],
+        'lesions': (features[..., COLUMN['lesion_fraction']] > t['lesions']) * p['lesions'],
+        'chlorosis': (features[..., COLUMN['chlorosis_fraction']] > t['chlorosis']) * p['chlorosis']
+    }
+
+
+def classify_features(features, rules=DEFAULT_RULES):
+    """Disease score, symptom code and confidence code for feature vectors"""
+    features = np.asarray(features)
+    score = sum(rule_points(features, rules).values())
+    green = features[..., COLUMN['green_ratio']]
+    red = features[..., COLUMN['red_ratio']]
+    b = rules['bands']
+
+    symptom = np.select(
+        [score >= b['very_high'], score >= b['high'], score >= b['medium']],
+        [RED_DOMINANT, np.where(red > green, RED_DOMINANT, LOW_GREEN), EARLY_SIGNS],
+        HEALTHY
+    )
+    confidence = np.select(
+        [score >= b['very_high'], score >= b['high'], score >= b['medium'],
+         (score == 1) & (green < rules['thresholds']['borderline_green'])],
+        [VERY_HIGH, HIGH, MEDIUM, LOW],
+        HIGH
+    )
+    return score, symptom, confidence
+
+
+PLANT_TYPE_BYTES = 64  # longest plant type name (UTF-8) a record holds
+
+
+def record_dtype(columns, plant_bytes=PLANT_TYPE_BYTES):
+    return np.dtype([
+        ('report_id', 'S24'),
+        ('plant_type', f'S{plant_bytes}'),
+        ('timestamp', 'f8'),
+        ('score', 'i1'),
+        ('symptom', 'i1'),
+        ('confidence', 'i1'),
+        ('features', 'f4', (len(columns),)),
+        ('hist', 'u1', (HIST_BINS,))
+    ])
+
+
+RECORD_DTYPE = record_dtype(FEATURE_COLUMNS)
+# Older shards, converted on load: 16-byte plant types, and before that no colour features (NaN)
+LEGACY_FORMATS = (
+    ('.features2', record_dtype(FEATURE_COLUMNS, plant_bytes=16)),
+    ('.features', record_dtype(CHANNEL_COLUMNS, plant_bytes=16))
+)
+
+
+def plant_type_bytes(plant_type, limit=PLANT_TYPE_BYTES):
+    """UTF-8 plant type cut to limit bytes on a character boundary"""
+    return plant_type.encode('utf-8')[:limit].decode('utf-8', 'ignore').encode('utf-8')
+
+
+def plant_type_name(raw):
+    """A stored plant type as text; bytes that do not decode (a name cut mid-character) are replaced"""
+    return raw.decode('utf-8', 'replace')
+
+
+class FeatureStore:
+    """Append-only binary feature records, one shard per process, read via memmap"""
+
+    SUFFIX = '.features3'
+
+    def __init__(self, root):
+        self.root = root
+        self._lock = threading.Lock()
+        self._file = None
+        self._pid = None
+
+    def _shard(self):
+        # Forked workers must not share the parent's file handle
+        if self._file is None or self._pid != os.getpid():
+            os.makedirs(self.root, exist_ok=True)
+            self._pid = os.getpid()
+            name = f"{socket.gethostname()}-{self._pid}{self.SUFFIX}"
+            self._file = open(os.path.join(self.root, name), 'ab')
+        return self._file
+
+    def append(self, report_id, plant_type, vector, hist, score, symptom, confidence):
+        record = np.zeros(1, dtype=RECORD_DTYPE)
+        record['report_id'] = report_id.encode('ascii')
+        record['plant_type'] = plant_type_bytes(plant_type)
+        record['timestamp'] = time.time()
+        record['score'] = score
+        record['symptom'] = symptom
+        record['confidence'] = confidence
+        record['features'] = vector
+        record['hist'] = hist
+        with self._lock:
+            shard = self._shard()
+            shard.write(record.tobytes())
+            shard.flush()
+
+    def shards(self, suffix=None):
+        return sorted(glob.glob(os.path.join(self.root, '*' + (suffix or self.SUFFIX))))
+
+    def load(self):
+        """All stored records as memory-mapped arrays (concatenated when there are several shards).
+
+        Legacy shards are converted in memory; missing colour features are NaN, which no rule scores.
+        """
+        arrays = []
+        for path in self.shards():
+            count = os.path.getsize(path) // RECORD_DTYPE.itemsize  # ignore a torn last record
+            if count:
+                arrays.append(np.memmap(path, dtype=RECORD_DTYPE, mode='r', shape=(count,)))
+        for suffix, dtype in LEGACY_FORMATS:
+            for path in self.shards(suffix):
+                count = os.path.getsize(path) // dtype.itemsize
+                if count:
+                    legacy = np.memmap(path, dtype=dtype, mode='r', shape=(count,))
+                    records = np.zeros(count, dtype=RECORD_DTYPE)
+                    for name in dtype.names:
+                        if name != 'features':
+                            records[name] = legacy[name]
+                    columns = legacy['features'].shape[1]
+                    records['features'][:, :columns] = legacy['features']
+                    records['features'][:, columns:] = np.nan
+                    arrays.append(records)
+        if not arrays:
+            return np.zeros(0, dtype=RECORD_DTYPE)
+        return arrays[0] if len(arrays) == 1 else np.concatenate(arrays)
+
+    def rescore(self, rules):
+        """Apply a rule set (or per-plant rule sets) to every stored feature vector and summarise what changes"""
+        started = time.perf_counter()
+        records = self.load()
+        plants, plant_index = np.unique(records['plant_type'], return_inverse=True)
+
+        if 'thresholds' in rules:
+            score, symptom, confidence = classify_features(records['features'], rules)
+        else:
+            symptom = np.zeros(len(records), dtype=np.int64)
+            confidence = np.zeros(len(records), dtype=np.int64)
+            for i, plant in enumerate(plants):
+                rows = plant_index == i
+                _, symptom[rows], confidence[rows] = classify_features(
+                    records['features'][rows], rules_for(rules, plant_type_name(plant)))
+
+        was_diseased = records['symptom'] != HEALTHY
+        now_diseased = symptom != HEALTHY
+
+        per_plant = {}
+        for i, plant in enumerate(plants):
+            rows = plant_index == i
+            per_plant[plant_type_name(plant)] = {
+                'total': int(rows.sum()),
+                'diseased_before': int((was_diseased & rows).sum()),
+                'diseased_after': int((now_diseased & rows).sum())
+            }
+
+        return {
+            'total': int(len(records)),
+            'diseased_before': int(was_diseased.sum()),
+            'diseased_after': int(now_diseased.sum()),
+            'status_changed': int((was_diseased != now_diseased).sum()),
+            'diagnosis_changed': int(((records['symptom'] != symptom) |
+                                      (records['confidence'] != confidence)).sum()),
+            'symptoms': {SYMPTOMS[code]: int(n) for code, n in
+                         enumerate(np.bincount(symptom, minlength=len(SYMPTOMS)))},
+            'plants': per_plant,
+            'elapsed_ms': round((time.perf_counter() - started) * 1000, 1)
+        }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Feature store tools')
+    commands = parser.add_subparsers(dest='command', required=True)
+    rescore = commands.add_parser('rescore', help='Re-evaluate stored features with a new rule set')
+    rescore.add_argument('--store', default=os.environ.get('FEATURE_STORE', 'feature_store'),
+                         help='Feature store directory')
+    rescore.add_argument('--rules', help='JSON file with thresholds/points/bands overrides, optionally per plant type')
+    args = parser.parse_args(argv)
+
+    summary = FeatureStore(args.store).rescore(load_rules_file(args.rules))
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+"""Per-region disease scores on a K x K grid of image blocks, and their heatmap.
+
+extract_features(img_array, block_sums=...) sums colorspace.BLOCK_WEIGHTS over
+the pixels of every block during the normal whole-image pass. From those sums,
+block_features derives a FEATURE_COLUMNS vector for every block, and
+classify_features scores all K * K blocks in one vectorized call with the
+same rules as the whole image. Block channel statistics come from the 15-bit
+codes (8 levels per code and channel), with the variance corrected for that
+quantization, so they are within about a level of the exact values.
+
+Blocks that are mostly background (less than `min_leaf` leaf tissue) are not
+scored: background colours trip the low-green rules.
+
+Results carry only the scores; heatmap_png renders them as an image when a
+report or a client asks for it.
+"""
+import base64
+import io
+
+import numpy as np
+from PIL import Image
+
+from colorspace import BLOCK_WEIGHTS, QUANT_BITS, color_features_from_sums
+from features import COLUMN, classify_features
+
+GRID_DEFAULTS = {
+    'enabled': True,
+    'size': 8,          # K: blocks per side
+    'worst': 3,         # blocks listed in the results, highest scores first (symptomatic ones only)
+    'min_leaf': 0.25,   # leaf fraction below which a block counts as background
+    'cell_px': 12       # heatmap pixels per block
+}
+
+# Heatmap colours: healthy green, through amber, to diseased red; grey for background
+SCORE_COLORS = np.array([(46, 125, 50), (255, 193, 7), (211, 47, 47)], dtype=np.float64)
+BACKGROUND_COLOR = (210, 210, 210)
+
+_QUANT_VARIANCE = (1 << (8 - QUANT_BITS)) ** 2 / 12  # Sheppard's correction for binned values
+
+
+def new_block_sums(size):
+    """Zeroed per-block sums for extract_features to fill"""
+    return np.zeros((size, size, BLOCK_WEIGHTS.shape[1]), dtype=np.float64)
+
+
+def block_features(block_sums):
+    """(K, K, len(FEATURE_COLUMNS)) feature vectors from per-block BLOCK_WEIGHTS sums"""
+    color = color_features_from_sums(block_sums[..., 6:])
+    pixels = block_sums[..., 6:10].sum(axis=-1, keepdims=True)  # one class column per pixel
+    safe_pixels = np.where(pixels > 0, pixels, 1)
+    means = block_sums[..., 0:3] / safe_pixels
+    stds = np.sqrt(np.maximum(block_sums[..., 3:6] / safe_pixels - means ** 2 - _QUANT_VARIANCE, 0))
+    total = means.sum(axis=-1, keepdims=True)
+    ratios = means / np.where(total > 0, total, 1)
+    brightness = total / 3
+    return np.concatenate([means, stds, ratios, brightness, color], axis=-1).astype(np.float32)
+
+
+def grid_analysis(block_sums, shape, rules, settings=None):
+    """Block scores and the worst blocks, for a results dict"""
+    settings = dict(GRID_DEFAULTS, **(settings or {}))
+    size = block_sums.shape[0]
+    features = block_features(block_sums)
+    scores, _, _ = classify_features(features, rules)
+    leaf = features[..., COLUMN['leaf_fraction']] >= settings['min_leaf']
+    scale = rules['bands']['very_high']  # scores at or above it are full red
+
+    height, width = shape[:2]
+    block_height, block_width = height // size, width // size
+    order = np.lexsort((-features[..., COLUMN['lesion_fraction']].ravel(), -scores.ravel()))
+    worst = []
+    for index in order:
+        row, col = divmod(int(index), size)
+        if len(worst) >= settings['worst'] or scores[row, col] < rules['bands']['medium']:
+            break
+        if not leaf[row, col]:
+            continue
+        worst.append({
+            'row': row,
+            'col': col,
+            'score': int(scores[row, col]),
+            'lesion_fraction': round(float(features[row, col, COLUMN['lesion_fraction']]), 3),
+            'chlorosis_fraction': round(float(features[row, col, COLUMN['chlorosis_fraction']]), 3),
+            # left, top, right, bottom as fractions of the image
+            'box': [round(col * block_width / width, 4), round(row * block_height / height, 4),
+                    round((col + 1) * block_width / width, 4), round((row + 1) * block_height / height, 4)]
+        })
+
+    return {
+        'size': size,
+        'scale': scale,
+        'scores': np.where(leaf, scores, -1).tolist(),  # -1: background block
+        'worst': worst
+    }
+
+
+def heatmap_png(grid, cell_px=GRID_DEFAULTS['cell_px']):
+    """Small PNG of a results grid: one flat cell per block, from 0 (green) to its scale (red)"""
+    scores = np.asarray(grid['scores'], dtype=np.float64)
+    leaf = scores >= 0
+    level = np.clip(scores / max(grid['scale'], 1), 0, 1) * (len(SCORE_COLORS) - 1)
+    low = np.minimum(level.astype(np.intp), len(SCORE_COLORS) - 2)
+    blend = (level - low)[..., None]
+    colors = SCORE_COLORS[low] * (1 - blend) + SCORE_COLORS[low + 1] * blend
+    colors[~leaf] = BACKGROUND_COLOR
+    cells = np.repeat(np.repeat(np.round(colors).astype(np.uint8), cell_px, axis=0), cell_px, axis=1)
+    buffer = io.BytesIO()
+    Image.fromarray(cells, 'RGB').save(buffer, 'PNG', optimize=True)
+    return buffer.getvalue()
+
+
+def heatmap_data_url(grid, cell_px=GRID_DEFAULTS['cell_px']):
+    return 'data:image/png;base64,' + base64.b64encode(heatmap_png(grid, cell_px)).decode('ascii')
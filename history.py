@@ -0,0 +1,346 @@
+"""Analysis history - durable, indexed record of every diagnosis in SQLite.
+
+Requests never wait on the database: `record` drops the result on a queue and a
+background thread writes the queue out in batches, one transaction per batch.
+The database runs in WAL mode so reads (history pages, trends, exports) proceed
+while the writer is committing.
+
+Export from the command line:
+    python history.py export --format csv --out analyses.csv --plant-type Tomato --since 2024-01-01
+"""
+import argparse
+import atexit
+import csv
+import io
+import itertools
+import json
+import os
+import queue
+import sqlite3
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS analyses (
+    id INTEGER PRIMARY KEY,
+    report_id TEXT NOT NULL UNIQUE,
+    created_at INTEGER NOT NULL,
+    plant_type TEXT NOT NULL,
+    disease_name TEXT NOT NULL,
+    status TEXT NOT NULL,
+    confidence TEXT,
+    green_ratio REAL,
+    red_ratio REAL,
+    color_variation REAL,
+    analysis_date TEXT,
+    image_filename TEXT,
+    source TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_analyses_created ON analyses (created_at, id);
+CREATE INDEX IF NOT EXISTS idx_analyses_plant ON analyses (plant_type, created_at, id, disease_name, status);
+CREATE INDEX IF NOT EXISTS idx_analyses_disease ON analyses (disease_name, created_at, id);
+CREATE INDEX IF NOT EXISTS idx_analyses_status ON analyses (status, created_at, id);
+"""
+
+COLUMNS = [
+    'report_id', 'created_at', 'plant_type', 'disease_name', 'status', 'confidence',
+    'green_ratio', 'red_ratio', 'color_variation', 'analysis_date', 'image_filename', 'source'
+]
+
+FILTERS = {
+    'plant_type': 'plant_type = ?',
+    'disease': 'disease_name = ?',
+    'status': 'status = ?',
+    'since': 'created_at >= ?',
+    'until': 'created_at < ?'
+}
+
+EXPORT_COLUMNS = [
+    'report_id', 'created_at', 'analysis_date', 'plant_type', 'disease_name', 'status',
+    'confidence', 'green_ratio', 'red_ratio', 'color_variation', 'image_filename', 'source'
+]
+
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'jsonl': 'application/x-ndjson'
+}
+
+TREND_BUCKETS = {
+    'hour': 3600 * 1000,
+    'day': 86400 * 1000
+}
+
+_id_counter = itertools.count()
+
+
+def new_report_id():
+    """Report id unique across processes: millisecond clock, process id and a per-process counter"""
+    millis = time.time_ns() // 1_000_000
+    return f"RPT{millis:011X}{os.getpid() & 0xFFFF:04X}{next(_id_counter) & 0xFFFF:04X}"
+
+
+def parse_time(value):
+    """Epoch milliseconds from an ISO date/datetime or epoch seconds; None passes through"""
+    if value is None or value == '':
+        return None
+    try:
+        return int(float(value) * 1000)
+    except ValueError:
+        return int(datetime.fromisoformat(value).timestamp() * 1000)
+
+
+def encode_cursor(row):
+    return f"{row['created_at']}:{row['id']}"
+
+
+def decode_cursor(cursor):
+    created_at, row_id = cursor.split(':', 1)
+    return int(created_at), int(row_id)
+
+
+class HistoryStore:
+    """SQLite-backed analysis history with a batched background writer"""
+
+    def __init__(self, path, batch_size=500, max_pending=10000):
+        self.path = path
+        self.batch_size = batch_size
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._local = threading.local()
+        self._writer = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+        self.dropped = 0
+
+        conn = self._connect()
+        conn.executescript(SCHEMA)
+        conn.close()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    def connection(self):
+        """Read connection for the calling thread"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        return conn
+
+    # ---------- writing ----------
+
+    def record(self, results, source=None):
+        """Queue a finished analysis for storage without blocking the request"""
+        if 'error' in results or 'report_id' not in results:
+            return
+        self._ensure_writer()
+        row = (
+            results['report_id'],
+            int(time.time() * 1000),
+            results.get('plant_type', 'Unknown'),
+            results.get('disease_name', 'Unknown'),
+            results.get('status', 'UNKNOWN'),
+            results.get('confidence'),
+            results.get('green_ratio'),
+            results.get('red_ratio'),
+            results.get('color_variation'),
+            results.get('analysis_date'),
+            results.get('image_filename'),
+            source
+        )
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            self.dropped += 1
+            print(f"⚠️ History queue full, dropped {results['report_id']}")
+
+    def _ensure_writer(self):
+        if self._writer is not None and self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid != os.getpid():
+                # Forked worker: the parent's writer thread and connections did not come along
+                self._writer = None
+                self._pid = os.getpid()
+                self._queue = queue.Queue(maxsize=self._queue.maxsize)
+                self._local = threading.local()
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._write_loop, name='history-writer', daemon=True)
+                self._writer.start()
+                atexit.register(self.close)
+
+    def _write_loop(self):
+        conn = self._connect()
+        insert = f"INSERT OR IGNORE INTO analyses ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})"
+        stopping = False
+        while not stopping:
+            row = self._queue.get()
+            batch = []
+            while row is not None:
+                batch.append(row)
+                if len(batch) >= self.batch_size:
+                    break
+                try:
+                    row = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+            if row is None:
+                stopping = True
+            if batch:
+                try:
+                    with conn:
+                        conn.executemany(insert, batch)
+                except sqlite3.Error as e:
+                    print(f"❌ History write failed ({len(batch)} rows): {e}")
+        conn.close()
+
+    def close(self):
+        """Flush queued rows and stop the writer"""
+        if self._writer is not None and self._writer.is_alive():
+            self._queue.put(None)
+            self._writer.join()
+
+    # ---------- reading ----------
+
+    def _where(self, filters):
+        clauses, params = [], []
+        for name, clause in FILTERS.items():
+            value = filters.get(name)
+            if name in ('since', 'until'):
+                value = parse_time(value)
+            if value is not None and value != '':
+                clauses.append(clause)
+                params.append(value)
+        return clauses, params
+
+    def query(self, filters=None, limit=50, after=None):
+        """Newest-first page of analyses; pass the returned cursor as `after` for the next page"""
+        clauses, params = self._where(filters or {})
+        if after:
+            clauses.append('(created_at, id) < (?, ?)')
+            params.extend(decode_cursor(after))
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+        rows = self.connection().execute(
+            f"SELECT id, {', '.join(COLUMNS)} FROM analyses {where} "
+            f"ORDER BY created_at DESC, id DESC LIMIT ?",
+            params + [limit]
+        ).fetchall()
+        items = [dict(row) for row in rows]
+        next_cursor = encode_cursor(items[-1]) if len(items) == limit else None
+        for item in items:
+            del item['id']
+        return items, next_cursor
+
+    def get(self, report_id):
+        row = self.connection().execute(
+            f"SELECT {', '.join(COLUMNS)} FROM analyses WHERE report_id = ?", (report_id,)
+        ).fetchone()
+        return dict(row) if row else None
+
+    def trend(self, filters=None, bucket='day'):
+        """Diagnosis counts per time bucket, disease and status"""
+        width = TREND_BUCKETS[bucket]
+        clauses, params = self._where(filters or {})
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+        rows = self.connection().execute(
+            f"SELECT (created_at / ?) * ? AS bucket, disease_name, status, COUNT(*) AS count "
+            f"FROM analyses {where} GROUP BY bucket, disease_name, status ORDER BY bucket",
+            [width, width] + params
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def iter_rows(self, filters=None, batch_size=2000):
+        """Yield matching analyses oldest first, in short keyset-paged reads.
+
+        Each batch is its own read, so an export of any size holds neither a
+        long transaction nor more than one batch in memory. Rows recorded after
+        the export started are left out.
+        """
+        filters = dict(filters or {})
+        if parse_time(filters.get('until')) is None:
+            filters['until'] = time.time()
+        clauses, params = self._where(filters)
+        conn = self._connect()
+        try:
+            last = None
+            while True:
+                page_clauses, page_params = list(clauses), list(params)
+                if last:
+                    page_clauses.append('(created_at, id) > (?, ?)')
+                    page_params.extend(last)
+                where = f"WHERE {' AND '.join(page_clauses)}" if page_clauses else ''
+                rows = conn.execute(
+                    f"SELECT id, {', '.join(EXPORT_COLUMNS)} FROM analyses {where} "
+                    f"ORDER BY created_at, id LIMIT ?",
+                    page_params + [batch_size]
+                ).fetchall()
+                if not rows:
+                    return
+                last = (rows[-1]['created_at'], rows[-1]['id'])
+                yield rows
+        finally:
+            conn.close()
+
+    def export(self, filters=None, fmt='csv'):
+        """Stream matching analyses as CSV or JSON Lines text chunks"""
+        if fmt not in EXPORT_FORMATS:
+            raise ValueError(f"format must be one of {', '.join(EXPORT_FORMATS)}")
+
+        def as_record(row):
+            record = {column: row[column] for column in EXPORT_COLUMNS}
+            record['created_at'] = datetime.fromtimestamp(
+                row['created_at'] / 1000, timezone.utc).isoformat(timespec='milliseconds')
+            return record
+
+        if fmt == 'csv':
+            buffer = io.StringIO()
+            writer = csv.DictWriter(buffer, fieldnames=EXPORT_COLUMNS)
+            writer.writeheader()
+            yield buffer.getvalue()
+            for rows in self.iter_rows(filters):
+                buffer.seek(0)
+                buffer.truncate()
+                writer.writerows(as_record(row) for row in rows)
+                yield buffer.getvalue()
+        else:
+            for rows in self.iter_rows(filters):
+                yield ''.join(json.dumps(as_record(row)) + '\n' for row in rows)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Analysis history tools')
+    commands = parser.add_subparsers(dest='command', required=True)
+    export = commands.add_parser('export', help='Export stored analyses as CSV or JSON Lines')
+    export.add_argument('--db', default=os.environ.get('HISTORY_DB', 'history.db'), help='History database')
+    export.add_argument('--format', choices=list(EXPORT_FORMATS), default='csv')
+    export.add_argument('--out', help='Output file (default: stdout)')
+    export.add_argument('--plant-type')
+    export.add_argument('--disease')
+    export.add_argument('--status')
+    export.add_argument('--since', help='ISO date/datetime or epoch seconds')
+    export.add_argument('--until', help='ISO date/datetime or epoch seconds')
+    args = parser.parse_args(argv)
+
+    store = HistoryStore(args.db)
+    filters = {
+        'plant_type': args.plant_type,
+        'disease': args.disease,
+        'status': args.status,
+        'since': args.since,
+        'until': args.until
+    }
+    out = open(args.out, 'w', encoding='utf-8', newline='') if args.out else sys.stdout
+    try:
+        for chunk in store.export(filters, args.format):
+            out.write(chunk)
+    finally:
+        if args.out:
+            out.close()
+
+
+if __name__ == '__main__':
+    main()
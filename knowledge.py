@@ -0,0 +1,141 @@
+"""Disease knowledge base, loaded from knowledge_base.json and reloaded on change.
+
+The JSON file holds, per plant, the disease each symptom type maps to and the
+status, treatments and prevention text of each disease, plus generic advice
+for plant/disease pairs it has no entry for. Its "version" is bumped with
+every content change.
+
+A KnowledgeBase is an immutable compiled snapshot of one version of the file.
+KnowledgeStore.current() returns the latest snapshot: every `check_interval`
+seconds it compares the file's mtime and size, and when they changed and the
+content hash differs it compiles a new snapshot and swaps the reference. The
+old snapshot is never modified, so a request that took a snapshot keeps a
+consistent view, and readers never take a lock. A file that fails to load is
+reported and the previous snapshot stays in service.
+"""
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+
+KNOWLEDGE_BASE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'knowledge_base.json')
+GENERIC_IDS = {'HEALTHY': 'generic.healthy', 'DISEASED': 'generic.diseased'}
+
+
+def slug(text):
+    return re.sub(r'[^a-z0-9]+', '-', str(text).lower()).strip('-')
+
+
+def kb_id(plant_type, disease_name):
+    """Stable knowledge-base id of a plant's disease entry, e.g. "tomato.early-blight" """
+    return f"{slug(plant_type)}.{slug(disease_name)}"
+
+
+class KnowledgeBase:
+    """One compiled version of the knowledge base; treat everything in it as read-only"""
+
+    def __init__(self, data, content_hash=None):
+        self.version = data['version']
+        self.hash = content_hash
+        self.default_disease = data['default_disease']
+        self.loaded_at = time.time()
+
+        # plant -> disease -> info, the shape the rest of the app reads
+        self.diseases = {plant: dict(entry.get('diseases', {})) for plant, entry in data['plants'].items()}
+        self.symptoms = {plant: dict(entry.get('symptoms', {})) for plant, entry in data['plants'].items()}
+        self.plant_names = {plant.lower(): plant for plant in self.diseases}
+        self.generic = {GENERIC_IDS[info['status']]: info for info in data['generic'].values()}
+
+        self.entries = {entry_id: dict(info, id=entry_id) for entry_id, info in self.generic.items()}
+        for plant, diseases in self.diseases.items():
+            for disease, info in diseases.items():
+                entry_id = kb_id(plant, disease)
+                self.entries[entry_id] = dict(info, id=entry_id, plant_type=plant, disease_name=disease)
+        self.etags = {entry_id: hashlib.sha1(json.dumps(entry, sort_keys=True).encode('utf-8')).hexdigest()[:20]
+                      for entry_id, entry in self.entries.items()}
+
+    def disease_for(self, plant_type, symptom_type):
+        """Disease a symptom type indicates on a plant"""
+        return self.symptoms.get(plant_type, {}).get(symptom_type, self.default_disease)
+
+    def info(self, plant_type, disease):
+        """Status, color, treatments and prevention for a diagnosis (generic advice when unknown)"""
+        known = self.diseases.get(plant_type, {}).get(disease)
+        if known is not None:
+            return known
+        return self.generic[GENERIC_IDS['HEALTHY' if disease == 'Healthy' else 'DISEASED']]
+
+    def entry_id(self, plant_type, disease, status):
+        """Id of the entry a diagnosis's advice came from"""
+        entry_id = kb_id(plant_type, disease)
+        return entry_id if entry_id in self.entries else GENERIC_IDS.get(status, GENERIC_IDS['DISEASED'])
+
+    def summary(self):
+        return {
+            'version': self.version,
+            'hash': self.hash,
+            'loaded_at': self.loaded_at,
+            'plants': len(self.diseases),
+            'entries': len(self.entries)
+        }
+
+
+def load_knowledge_base(path=KNOWLEDGE_BASE_PATH):
+    with open(path, 'rb') as f:
+        raw = f.read()
+    return KnowledgeBase(json.loads(raw), hashlib.sha256(raw).hexdigest()[:16])
+
+
+class KnowledgeStore:
+    """The current KnowledgeBase for a file, swapped for a new snapshot when the file changes"""
+
+    def __init__(self, path=KNOWLEDGE_BASE_PATH, check_interval=1.0):
+        self.path = path
+        self.check_interval = check_interval
+        self._snapshot = None
+        self._signature = None
+        self._next_check = 0.0
+        self._reload_lock = threading.Lock()  # one reloading thread; readers never wait on it
+        self.reloads = 0
+        self.errors = 0
+
+    def current(self):
+        """The latest snapshot; hold on to it for the rest of the request"""
+        snapshot = self._snapshot
+        if snapshot is None or time.monotonic() >= self._next_check:
+            self._maybe_reload(blocking=snapshot is None)
+            snapshot = self._snapshot
+        return snapshot
+
+    def _maybe_reload(self, blocking):
+        if not self._reload_lock.acquire(blocking=blocking):
+            return
+        try:
+            self._next_check = time.monotonic() + self.check_interval
+            try:
+                stat = os.stat(self.path)
+                signature = (stat.st_mtime_ns, stat.st_size)
+                if signature == self._signature and self._snapshot is not None:
+                    return
+                snapshot = load_knowledge_base(self.path)
+            except (OSError, ValueError, KeyError) as e:
+                self.errors += 1
+                if self._snapshot is None:
+                    raise
+                print(f"❌ Knowledge base reload failed, keeping version {self._snapshot.version}: {e}")
+                self._signature = None if isinstance(e, OSError) else signature  # retry bad content only once changed
+                return
+            self._signature = signature
+            if self._snapshot is None or snapshot.hash != self._snapshot.hash:
+                if self._snapshot is not None:
+                    self.reloads += 1
+                    print(f"📚 Knowledge base reloaded: version {self._snapshot.version} -> {snapshot.version}")
+                self._snapshot = snapshot
+        finally:
+            self._reload_lock.release()
+
+    def stats(self):
+        snapshot = self.current()
+        return dict(snapshot.summary(), path=self.path, reloads=self.reloads, errors=self.errors)
@@ -0,0 +1,22 @@
+"""Process-wide counters, served at /metrics.
+
+Counter names are dotted, e.g. "image_rejected.too_many_pixels".
+"""
+import threading
+import time
+from collections import Counter
+
+_lock = threading.Lock()
+_counters = Counter()
+_started = time.time()
+
+
+def incr(name, amount=1):
+    with _lock:
+        _counters[name] += amount
+
+
+def snapshot():
+    with _lock:
+        counters = dict(_counters)
+    return {'uptime_seconds': round(time.time() - _started, 1), 'counters': counters}
@@ -0,0 +1,100 @@
+"""Perceptual-hash index for reusing diagnoses of near-identical camera frames.
+
+Frames of the same leaf taken a moment apart differ in a few bytes, so an
+exact content hash never matches. A difference hash (dHash) of a 9x8
+grayscale thumbnail does: near-identical frames land within a few bits of
+each other. The index keeps the most recent hashes per key in a fixed-size
+ring buffer and compares a new hash against all of them at once with XOR
+and a byte popcount table. Keys come from client input, so only the
+`max_keys` most recently used keys keep a ring; older ones are dropped.
+"""
+import io
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from PIL import Image
+
+from validation import JPEG_FORMATS
+
+HASH_BITS = 64
+_POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+def dhash(img):
+    """64-bit difference hash: does each pixel of a 9x8 grayscale thumbnail outshine its right neighbour"""
+    if img.format in JPEG_FORMATS:
+        img.draft('L', (64, 64))  # let the JPEG decoder downscale instead of decoding every pixel
+    small = np.asarray(img.convert('L').resize((9, 8), Image.BOX), dtype=np.int16)
+    bits = (small[:, 1:] > small[:, :-1]).ravel()
+    return int(np.packbits(bits).view('>u8')[0])
+
+
+def image_bytes_hash(image_data):
+    with Image.open(io.BytesIO(image_data)) as img:
+        return dhash(img)
+
+
+class NearDuplicateIndex:
+    """Recent (hash, result) pairs per key with nearest-neighbour lookup by Hamming distance"""
+
+    def __init__(self, max_entries=1024, max_distance=4, max_keys=64):
+        self.max_entries = max_entries
+        self.max_distance = max_distance
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> [hashes array, results list, next slot, count], least recent first
+        self.hits = 0
+        self.misses = 0
+        self.evicted_keys = 0
+        self.distances = np.zeros(HASH_BITS + 1, dtype=np.int64)  # nearest distance per lookup
+
+    def lookup(self, key, image_hash):
+        """(cached results, distance) of the nearest recent hash within max_distance, else None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[3] == 0:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            hashes, results, _, count = entry
+            xor = hashes[:count] ^ np.uint64(image_hash)
+            distances = _POPCOUNT[xor.view(np.uint8)].reshape(count, 8).sum(axis=1)
+            nearest = int(distances.argmin())
+            distance = int(distances[nearest])
+            self.distances[distance] += 1
+            if distance > self.max_distance:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return results[nearest], distance
+
+    def add(self, key, image_hash, results):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                while len(self._entries) >= self.max_keys:
+                    self._entries.popitem(last=False)
+                    self.evicted_keys += 1
+                entry = self._entries[key] = [np.zeros(self.max_entries, dtype=np.uint64),
+                                              [None] * self.max_entries, 0, 0]
+            else:
+                self._entries.move_to_end(key)
+            hashes, stored, slot, count = entry
+            hashes[slot] = image_hash
+            stored[slot] = results
+            entry[2] = (slot + 1) % self.max_entries
+            entry[3] = min(count + 1, self.max_entries)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'max_distance': self.max_distance,
+                'evicted_keys': self.evicted_keys,
+                'entries': {str(key): entry[3] for key, entry in self._entries.items()},
+                'distance_histogram': {d: int(n) for d, n in enumerate(self.distances) if n}
+            }
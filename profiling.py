@@ -0,0 +1,136 @@
+"""Opt-in per-request CPU profiling and allocation tracing.
+
+A request is profiled when the caller sends the profiling token (header
+`X-Profile-Token` or query parameter `profile`), or when it is the Nth
+request with 1-in-N sampling on. Profiled requests run under cProfile and
+tracemalloc, and leave two files in the profiles directory:
+
+- <id>.prof: the cProfile stats (`python -m pstats <id>.prof`, or snakeviz)
+- <id>.json: request, timing, image details, top functions and top allocation sites
+
+Only the newest `max_reports` reports are kept. With no token and no sampling
+configured, deciding not to profile is a single attribute check.
+"""
+import cProfile
+import hmac
+import io
+import itertools
+import json
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+
+PROFILING_DEFAULTS = {
+    'token': None,          # callers presenting this token get profiled
+    'sample_every': 0,      # also profile 1 in N requests (0: never)
+    'directory': 'profiles',
+    'max_reports': 200,     # older reports are deleted
+    'top_functions': 30,
+    'top_allocations': 25,
+    'traceback_frames': 1   # tracemalloc frames kept per allocation
+}
+
+
+class RequestProfiler:
+    """Decides which requests to profile and writes their reports"""
+
+    def __init__(self, settings=None):
+        self.settings = dict(PROFILING_DEFAULTS, **(settings or {}))
+        self.enabled = bool(self.settings['token'] or self.settings['sample_every'])
+        self._requests = itertools.count(1)
+        # cProfile and tracemalloc are process-wide: one profiled request at a time
+        self._busy = threading.Lock()
+
+    def requested(self, headers, args):
+        """Whether this request should be profiled"""
+        if not self.enabled:
+            return False
+        token = self.settings['token']
+        if token:
+            presented = headers.get('X-Profile-Token') or args.get('profile')
+            if presented and hmac.compare_digest(presented, token):
+                return True
+        every = self.settings['sample_every']
+        return bool(every) and next(self._requests) % every == 0
+
+    @contextmanager
+    def profile(self, name, request_info=None):
+        """Profile the block; yields a dict the caller can add details to (None if another profile is running)"""
+        if not self._busy.acquire(blocking=False):
+            yield None
+            return
+        try:
+            report = {'endpoint': name, 'request': request_info or {}}
+            tracing = tracemalloc.is_tracing()
+            if not tracing:
+                tracemalloc.start(self.settings['traceback_frames'])
+            tracemalloc.reset_peak()
+            profiler = cProfile.Profile()
+            started = time.perf_counter()
+            profiler.enable()
+            try:
+                yield report
+            finally:
+                profiler.disable()
+                report['elapsed_ms'] = round((time.perf_counter() - started) * 1000, 2)
+                snapshot = tracemalloc.take_snapshot()
+                report['peak_traced_kb'] = round(tracemalloc.get_traced_memory()[1] / 1024, 1)
+                if not tracing:
+                    tracemalloc.stop()
+                report['id'] = self._write(name, profiler, snapshot, report)
+        finally:
+            self._busy.release()
+
+    def _write(self, name, profiler, snapshot, report):
+        directory = self.settings['directory']
+        os.makedirs(directory, exist_ok=True)
+        report_id = f"{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}-{os.getpid()}-{name}"
+        path = os.path.join(directory, report_id)
+
+        profiler.dump_stats(path + '.prof')
+        report['top_functions'] = top_functions(profiler, self.settings['top_functions'])
+        report['top_allocations'] = top_allocations(snapshot, self.settings['top_allocations'])
+        with open(path + '.json', 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, default=str)
+
+        self._rotate(directory)
+        print(f"🔬 Profiled {name} in {report['elapsed_ms']} ms -> {path}.json")
+        return report_id
+
+    def _rotate(self, directory):
+        reports = sorted(name[:-5] for name in os.listdir(directory) if name.endswith('.json'))
+        for stem in reports[:-self.settings['max_reports']]:
+            for suffix in ('.json', '.prof'):
+                try:
+                    os.remove(os.path.join(directory, stem + suffix))
+                except OSError:
+                    pass
+
+
+def top_functions(profiler, limit):
+    """The functions with the most cumulative time, as dicts"""
+    stats = pstats.Stats(profiler, stream=io.StringIO())
+    rows = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:limit]
+    return [{
+        'function': f"{os.path.basename(filename)}:{line}({function})",
+        'calls': calls,
+        'own_ms': round(own * 1000, 3),
+        'cumulative_ms': round(cumulative * 1000, 3)
+    } for (filename, line, function), (_, calls, own, cumulative, _) in rows]
+
+
+def top_allocations(snapshot, limit):
+    """Source lines holding the most memory still allocated at the end of the request"""
+    snapshot = snapshot.filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap*>')
+    ])
+    return [{
+        'line': f"{os.path.basename(stat.traceback[0].filename)}:{stat.traceback[0].lineno}",
+        'size_kb': round(stat.size / 1024, 1),
+        'blocks': stat.count
+    } for stat in snapshot.statistics('lineno')[:limit]]
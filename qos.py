@@ -0,0 +1,95 @@
+"""Adaptive quality of service - cheaper analysis tiers under load.
+
+The LoadMonitor tracks how many analysis requests are in flight and a moving
+average of their latency (queue time included when a proxy sends an
+X-Request-Start header). When either crosses a threshold the next request is
+served at a cheaper tier:
+
+- full: the image at its uploaded resolution
+- reduced: decoded at most `reduced_max_side` pixels on a side, and optional
+  work (saving the upload, embedding the image in the PDF) is skipped
+- thumbnail: statistics of a `thumbnail_max_side` thumbnail, same skips
+"""
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+TIERS = ['full', 'reduced', 'thumbnail']
+
+QOS_DEFAULTS = {
+    'enabled': True,
+    'reduced_at': {'in_flight': 4, 'latency_ms': 800},
+    'thumbnail_at': {'in_flight': 8, 'latency_ms': 2000},
+    'reduced_max_side': 512,
+    'thumbnail_max_side': 64,
+    'latency_smoothing': 0.2  # weight of the newest request in the latency average
+}
+
+
+def queue_ms(headers, now=None):
+    """Time since the proxy received the request, from X-Request-Start (t=<seconds|ms|us>), else 0"""
+    value = headers.get('X-Request-Start', '')
+    if value.startswith('t='):
+        value = value[2:]
+    try:
+        started = float(value)
+    except ValueError:
+        return 0.0
+    now = time.time() if now is None else now
+    # Proxies send seconds, milliseconds or microseconds since the epoch
+    while started > now * 10:
+        started /= 1000
+    return max(0.0, (now - started) * 1000)
+
+
+class LoadMonitor:
+    """In-flight count and smoothed latency, mapped onto an analysis tier"""
+
+    def __init__(self, settings=None):
+        self.settings = dict(QOS_DEFAULTS, **(settings or {}))
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.latency_ms = 0.0
+        self.tiers_served = Counter()
+
+    def tier(self):
+        s = self.settings
+        if not s['enabled']:
+            return 'full'
+        for name, limits in (('thumbnail', s['thumbnail_at']), ('reduced', s['reduced_at'])):
+            if self.in_flight >= limits['in_flight'] or self.latency_ms >= limits['latency_ms']:
+                return name
+        return 'full'
+
+    def max_side(self, tier):
+        """Decode size limit for a tier (None for full resolution)"""
+        return self.settings.get(f'{tier}_max_side')
+
+    @contextmanager
+    def track(self, headers=None):
+        """Count a request as in flight for the duration of the block and yield its tier"""
+        started = time.perf_counter()
+        waited = queue_ms(headers) if headers is not None else 0.0
+        with self._lock:
+            tier = self.tier()
+            self.in_flight += 1
+            self.tiers_served[tier] += 1
+        try:
+            yield tier
+        finally:
+            elapsed = waited + (time.perf_counter() - started) * 1000
+            alpha = self.settings['latency_smoothing']
+            with self._lock:
+                self.in_flight -= 1
+                self.latency_ms += alpha * (elapsed - self.latency_ms)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'tier': self.tier(),
+                'in_flight': self.in_flight,
+                'latency_ms': round(self.latency_ms, 1),
+                'tiers_served': dict(self.tiers_served),
+                'settings': self.settings
+            }
@@ -0,0 +1,116 @@
+"""Early-reject quality gate for uploaded and captured images.
+
+Runs on a small thumbnail (JPEG frames are downscaled by the decoder itself)
+before the image is saved or analysed, and rejects frames the colour rules
+would misread: black or blown-out exposures, flat frames, motion blur and
+frames with no plant in them. Each rejection carries a reason code.
+"""
+import io
+import threading
+from collections import Counter
+
+import numpy as np
+from PIL import Image
+
+QUALITY_DEFAULTS = {
+    'thumbnail_size': 128,
+    'min_brightness': 30,     # mean luma below: too_dark
+    'max_brightness': 230,    # mean luma above: overexposed
+    'min_contrast': 12,       # 5th-95th percentile luma spread below: low_contrast
+    'min_sharpness': 20.0,    # Laplacian variance below: blurry
+    'min_vegetation': 0.10    # fraction of green/yellow/brown pixels below: no_vegetation
+}
+
+REASONS = {
+    'unreadable': 'Image could not be decoded',
+    'too_dark': 'Image is too dark',
+    'overexposed': 'Image is overexposed',
+    'low_contrast': 'Image has almost no detail',
+    'blurry': 'Image is too blurry',
+    'no_vegetation': 'No leaf found in the image'
+}
+
+
+def load_thumbnail(image_data, size):
+    """Decode image bytes to a small RGB thumbnail without decoding every pixel of a JPEG"""
+    img = Image.open(io.BytesIO(image_data))
+    img.draft('RGB', (size * 2, size * 2))
+    is_color = img.mode not in ('1', 'L', 'I', 'F', 'LA', 'I;16')
+    img = img.convert('RGB')
+    img.thumbnail((size, size), Image.BILINEAR)
+    return img, is_color
+
+
+def laplacian_variance(gray):
+    """Variance of the 4-neighbour Laplacian - low for blurred images"""
+    lap = (gray[:-2, 1:-1] + gray[2:, 1:-1] + gray[1:-1, :-2] + gray[1:-1, 2:]
+           - 4 * gray[1:-1, 1:-1])
+    return float(lap.var()) if lap.size else 0.0
+
+
+def vegetation_fraction(rgb):
+    """Fraction of saturated green, yellow or brown pixels (healthy and diseased leaf tissue)"""
+    rgb = rgb.astype(np.int16)
+    r, g, b = rgb[..., 0], rgb[..., 1], rgb[..., 2]
+    saturated = (rgb.max(axis=-1) - rgb.min(axis=-1)) > 20
+    green = (g >= r) & (g > b)
+    yellow_brown = (r > g) & (g > b)
+    return float((saturated & (green | yellow_brown)).mean())
+
+
+class QualityGate:
+    """Thumbnail checks with per-reason rejection counters"""
+
+    def __init__(self, settings=None):
+        self.settings = dict(QUALITY_DEFAULTS, **(settings or {}))
+        self._lock = threading.Lock()
+        self.checked = 0
+        self.rejections = Counter()
+
+    def check(self, image_data):
+        """(reason code or None, metrics, thumbnail); the thumbnail is None for unreadable images"""
+        s = self.settings
+        try:
+            thumb, is_color = load_thumbnail(image_data, s['thumbnail_size'])
+        except Exception as e:
+            return self._result('unreadable', {'decode_error': str(e)}, None)
+
+        rgb = np.asarray(thumb)
+        gray = rgb @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+        low, high = np.percentile(gray, [5, 95])
+        metrics = {
+            'brightness': round(float(gray.mean()), 1),
+            'contrast': round(float(high - low), 1),
+            'sharpness': round(laplacian_variance(gray), 1),
+            'vegetation': round(vegetation_fraction(rgb), 3) if is_color else None
+        }
+
+        if metrics['brightness'] < s['min_brightness']:
+            reason = 'too_dark'
+        elif metrics['brightness'] > s['max_brightness']:
+            reason = 'overexposed'
+        elif metrics['contrast'] < s['min_contrast']:
+            reason = 'low_contrast'
+        elif metrics['sharpness'] < s['min_sharpness']:
+            reason = 'blurry'
+        elif is_color and metrics['vegetation'] < s['min_vegetation']:
+            reason = 'no_vegetation'
+        else:
+            reason = None
+        return self._result(reason, metrics, thumb)
+
+    def _result(self, reason, metrics, thumb):
+        with self._lock:
+            self.checked += 1
+            if reason:
+                self.rejections[reason] += 1
+        return reason, metrics, thumb
+
+    def stats(self):
+        with self._lock:
+            return {
+                'checked': self.checked,
+                'rejected': sum(self.rejections.values()),
+                'rejections': dict(self.rejections),
+                'settings': self.settings
+            }
@@ -0,0 +1,188 @@
+"""Offline directory scan - run the disease analysis over an image archive.
+
+Usage:
+    python scan.py IMAGES_DIR --out results.csv
+    python scan.py IMAGES_DIR --out results.jsonl --plant Potato --workers 8
+    python scan.py IMAGES_DIR --out results.csv --plant-map folders.json
+
+The plant type of each image comes from the nearest parent folder listed in
+--plant-map (a JSON object of folder name -> plant type), then from a parent
+folder named after a known plant, and finally from --plant.
+
+Every finished image is appended to a checkpoint file, so an interrupted scan
+can be re-run with the same arguments and only the remaining images are analysed.
+"""
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+from app import allowed_file, analyze_plant_disease, get_app, knowledge_base
+
+RESULT_FIELDS = [
+    'path', 'plant_type', 'disease_name', 'status', 'confidence',
+    'green_ratio', 'red_ratio', 'color_variation', 'lesion_fraction',
+    'chlorosis_fraction', 'analysis_date',
+    'report_id', 'error'
+]
+
+
+def walk_images(root):
+    """Yield image paths relative to root, walking the tree without listing it all up front"""
+    stack = ['']
+    while stack:
+        rel_dir = stack.pop()
+        try:
+            entries = sorted(os.scandir(os.path.join(root, rel_dir)), key=lambda e: e.name)
+        except OSError as e:
+            print(f"❌ Cannot read {os.path.join(root, rel_dir)}: {e}", file=sys.stderr)
+            continue
+        for entry in entries:
+            rel_path = os.path.join(rel_dir, entry.name)
+            if entry.is_dir(follow_symlinks=False):
+                stack.append(rel_path)
+            elif entry.is_file() and allowed_file(entry.name):
+                yield rel_path
+
+
+def resolve_plant_type(rel_path, plant_map, default_plant, known_plants=None):
+    """Pick the plant type for an image from its folder names"""
+    if known_plants is None:
+        known_plants = knowledge_base().plant_names
+    folders = os.path.dirname(rel_path).split(os.sep)
+    for folder in reversed(folders):
+        if folder in plant_map:
+            return plant_map[folder]
+        if folder.lower() in known_plants:
+            return known_plants[folder.lower()]
+    return default_plant
+
+
+def load_checkpoint(path):
+    """Read the set of images finished by a previous run"""
+    if not path or not os.path.exists(path):
+        return set()
+    with open(path, 'r', encoding='utf-8') as f:
+        return {line.rstrip('\n') for line in f if line.strip()}
+
+
+def _init_worker():
+    # analyze_plant_disease reports every step on stdout; keep the workers quiet
+    sys.stdout = open(os.devnull, 'w')
+    get_app()  # stores and backends for this process (already set up when forked)
+
+
+def _analyze_one(task):
+    rel_path, full_path, plant_type = task
+    results = analyze_plant_disease(full_path, plant_type)
+    results['path'] = rel_path
+    results.setdefault('plant_type', plant_type)
+    return results
+
+
+class ResultWriter:
+    """Append results to a CSV or JSON Lines file as they arrive"""
+
+    def __init__(self, path):
+        self.path = path
+        self.is_jsonl = path.lower().endswith(('.jsonl', '.ndjson'))
+        is_new = not os.path.exists(path) or os.path.getsize(path) == 0
+        self.file = open(path, 'a', encoding='utf-8', newline='')
+        if not self.is_jsonl:
+            self.csv = csv.DictWriter(self.file, fieldnames=RESULT_FIELDS, extrasaction='ignore')
+            if is_new:
+                self.csv.writeheader()
+
+    def write(self, results):
+        row = {field: results.get(field, '') for field in RESULT_FIELDS}
+        if self.is_jsonl:
+            self.file.write(json.dumps(row) + '\n')
+        else:
+            self.csv.writerow(row)
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def scan(root, out_path, plant_map=None, default_plant='Tomato', workers=None,
+         checkpoint_path=None, chunksize=16, progress_every=5.0):
+    """Analyse every image under root in a process pool and stream the results to out_path"""
+    plant_map = plant_map or {}
+    checkpoint_path = checkpoint_path or out_path + '.checkpoint'
+    done = load_checkpoint(checkpoint_path)
+    if done:
+        print(f"♻️ Resuming: {len(done)} images already processed", file=sys.stderr)
+
+    get_app()
+    known_plants = knowledge_base().plant_names
+
+    def tasks():
+        for rel_path in walk_images(root):
+            if rel_path in done:
+                continue
+            yield (rel_path, os.path.join(root, rel_path),
+                   resolve_plant_type(rel_path, plant_map, default_plant, known_plants))
+
+    writer = ResultWriter(out_path)
+    checkpoint = open(checkpoint_path, 'a', encoding='utf-8')
+    processed = errors = 0
+    started = last_report = time.monotonic()
+
+    try:
+        with multiprocessing.Pool(workers, initializer=_init_worker) as pool:
+            for results in pool.imap_unordered(_analyze_one, tasks(), chunksize=chunksize):
+                writer.write(results)
+                checkpoint.write(results['path'] + '\n')
+                processed += 1
+                if 'error' in results:
+                    errors += 1
+
+                now = time.monotonic()
+                if now - last_report >= progress_every:
+                    # Results must hit disk before the checkpoint claims them
+                    writer.flush()
+                    checkpoint.flush()
+                    rate = processed / (now - started)
+                    print(f"📊 {processed} images, {rate:.1f} img/s, {errors} errors", file=sys.stderr)
+                    last_report = now
+    finally:
+        writer.flush()
+        checkpoint.flush()
+        writer.close()
+        checkpoint.close()
+
+    elapsed = time.monotonic() - started
+    rate = processed / elapsed if elapsed > 0 else 0.0
+    print(f"✅ Scan finished: {processed} images in {elapsed:.1f}s ({rate:.1f} img/s), {errors} errors",
+          file=sys.stderr)
+    return processed, errors
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run plant disease analysis over a directory of images')
+    parser.add_argument('root', help='Directory to scan recursively')
+    parser.add_argument('--out', required=True, help='Output file (.csv, or .jsonl for JSON Lines)')
+    parser.add_argument('--plant', default='Tomato', help='Plant type when no folder mapping applies')
+    parser.add_argument('--plant-map', help='JSON file mapping folder names to plant types')
+    parser.add_argument('--workers', type=int, default=None, help='Worker processes (default: CPU count)')
+    parser.add_argument('--checkpoint', help='Checkpoint file (default: OUT.checkpoint)')
+    parser.add_argument('--chunksize', type=int, default=16, help='Images handed to a worker at a time')
+    args = parser.parse_args(argv)
+
+    plant_map = {}
+    if args.plant_map:
+        with open(args.plant_map, 'r', encoding='utf-8') as f:
+            plant_map = json.load(f)
+
+    scan(args.root, args.out, plant_map=plant_map, default_plant=args.plant,
+         workers=args.workers, checkpoint_path=args.checkpoint, chunksize=args.chunksize)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+"""Production server: gunicorn workers pre-forked from a preloaded app.
+
+Usage:
+    python serve.py --workers 4 --threads 8 --bind 0.0.0.0:5000
+    python serve.py --max-requests 2000 --timeout 60
+
+The app module is imported once in the master, so workers fork with Flask,
+NumPy, PIL and the disease database already in memory. Each worker then runs
+a warmup before it accepts connections: it decodes and analyses a synthetic
+leaf image and renders its PDF, without touching the history database or the
+feature store. The first real request on a worker is therefore not a cold one.
+
+Workers are gthread workers: each serves up to --threads requests at once,
+so a long /stream connection or history export occupies one thread, not a
+whole process, and the in-flight count the load shedder (qos.py) watches can
+actually climb. The timeout is the worker's heartbeat, not a per-request
+limit, so an open stream is not killed as a hung worker.
+
+Workers are recycled after --max-requests requests (with jitter, so they do
+not all restart at once), and each replacement is warmed the same way.
+`kill -HUP <master pid>` replaces every worker gracefully; `kill -USR2` starts
+a new master with reloaded code next to the old one (then TERM the old one).
+"""
+import argparse
+import contextlib
+import io
+import multiprocessing
+import os
+import time
+
+import numpy as np
+from PIL import Image
+
+SERVE_DEFAULTS = {
+    'bind': os.environ.get('BIND', '0.0.0.0:5000'),
+    'workers': int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count())),
+    # gthread rather than sync: streams and exports hold a thread each, and analysis
+    # releases the GIL in NumPy/PIL, so threads overlap; no gevent monkey-patching needed
+    'worker_class': 'gthread',
+    'threads': int(os.environ.get('WEB_THREADS', 8)),
+    'timeout': 60,             # seconds a worker may go without a heartbeat before it is restarted
+    'graceful_timeout': 30,    # seconds in-flight requests get on reload/shutdown
+    'max_requests': 1000,      # recycle a worker after this many requests (0 disables)
+    'max_requests_jitter': 100
+}
+
+
+def synthetic_leaf(size=256):
+    """JPEG bytes of a mottled green leaf with a brown spot"""
+    rng = np.random.default_rng(0)
+    pixels = np.empty((size, size, 3), dtype=np.uint8)
+    pixels[...] = (60, 140, 45)
+    pixels += rng.integers(0, 40, (size, size, 1), dtype=np.uint8)
+    pixels[size // 3:size // 2, size // 3:size // 2] = (120, 75, 35)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, 'JPEG', quality=90)
+    return buffer.getvalue()
+
+
+def warmup(plant_app):
+    """Exercise the request path once in this process; returns elapsed milliseconds"""
+    started = time.perf_counter()
+    image_bytes = synthetic_leaf()
+    with contextlib.redirect_stdout(io.StringIO()):
+        plant_app.knowledge_base()
+        plant_app.check_image_header(image_bytes)
+        plant_app.QualityGate(plant_app.quality_gate.settings).check(image_bytes)  # not the counted gate
+        plant_app.image_bytes_hash(image_bytes)
+        results = plant_app.analyze_plant_disease(io.BytesIO(image_bytes), 'Tomato', store_features=False)
+        plant_app.create_professional_pdf(results, embed_image=False).output(dest='S')
+        plant_app.app.test_client().get('/health')
+    return (time.perf_counter() - started) * 1000
+
+
+def post_fork(server, worker):
+    import app as plant_app
+    elapsed = warmup(plant_app)
+    server.log.info("🔥 Worker %s warmed up in %.0f ms", worker.pid, elapsed)
+
+
+def main(argv=None):
+    from gunicorn.app.base import BaseApplication
+
+    parser = argparse.ArgumentParser(description='Run the app with pre-forked gunicorn workers')
+    parser.add_argument('--bind', default=SERVE_DEFAULTS['bind'])
+    parser.add_argument('--workers', type=int, default=SERVE_DEFAULTS['workers'])
+    parser.add_argument('--threads', type=int, default=SERVE_DEFAULTS['threads'],
+                        help='Concurrent requests per worker')
+    parser.add_argument('--timeout', type=int, default=SERVE_DEFAULTS['timeout'])
+    parser.add_argument('--graceful-timeout', type=int, default=SERVE_DEFAULTS['graceful_timeout'])
+    parser.add_argument('--max-requests', type=int, default=SERVE_DEFAULTS['max_requests'],
+                        help='Recycle a worker after this many requests (0 disables)')
+    parser.add_argument('--max-requests-jitter', type=int, default=SERVE_DEFAULTS['max_requests_jitter'])
+    args = parser.parse_args(argv)
+
+    import app as plant_app
+
+    options = {
+        'bind': args.bind,
+        'workers': args.workers,
+        'worker_class': SERVE_DEFAULTS['worker_class'],
+        'threads': args.threads,
+        'timeout': args.timeout,
+        'graceful_timeout': args.graceful_timeout,
+        'max_requests': args.max_requests,
+        'max_requests_jitter': args.max_requests_jitter if args.max_requests else 0,
+        'preload_app': True,
+        'post_fork': post_fork
+    }
+
+    class Server(BaseApplication):
+        def load_config(self):
+            for key, value in options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return plant_app.app
+
+    print(f"🚀 Serving on {args.bind} with {args.workers} workers x {args.threads} threads")
+    Server().run()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,263 @@
+"""Host-wide cache shared by worker processes through a memory-mapped file.
+
+Every worker maps the same file (by default under /dev/shm, so it lives in
+RAM), so an entry stored by one worker is a hit in all the others. The file
+holds a fixed number of fixed-size slots, arranged set-associatively: a key
+hashes to one set of `ways` slots and can only live there, so a lookup
+compares at most `ways` slot headers.
+
+- Reads take no lock. Each slot has a sequence counter that writers make odd
+  while they rewrite the slot (a seqlock). A reader copies the value and
+  checks that the counter was even and unchanged, and that the CRC matches.
+  Otherwise it treats the lookup as a miss.
+- Writes are serialized by lockf on the file (plus a thread lock within
+  the process). POSIX record locks belong to the process, so a forked
+  worker locks through its inherited descriptor of the very file it maps. A write goes to a matching, empty or expired slot in the
+  set, or else evicts the least recently used one. Reads update the
+  last-used time without locking, so LRU is approximate.
+
+Values larger than `slot_bytes` are not cached. The file's space is reserved
+with posix_fallocate when it is opened: a full /dev/shm (Docker's default is
+64 MB) then fails the open with OSError instead of killing a worker with
+SIGBUS on the first write to an unbacked page.
+
+A file is never shrunk once it may be mapped, since every process mapping it
+would SIGBUS. A file with another geometry (a changed setting, or old and new
+workers side by side during a reload) is replaced: a new file is built beside
+it and renamed into place. Processes still mapping the old one keep using it
+until they exit.
+"""
+import hashlib
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # no lockf (Windows): writes are only serialized within the process
+    fcntl = None
+
+SHARED_CACHE_DEFAULTS = {
+    'enabled': True,
+    'directory': '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir(),
+    'namespace': 'plant-disease',  # file name prefix; deployments sharing a host need different ones
+    'results': {'entries': 4096, 'slot_bytes': 4 * 1024, 'ttl': 3600},   # ~16 MB
+    'reports': {'entries': 32, 'slot_bytes': 512 * 1024, 'ttl': 3600}    # ~16 MB
+}
+
+_process_lock = threading.Lock()
+
+MAGIC = b'PLCACHE1'
+FILE_HEADER = struct.Struct('<8sIII')  # magic, sets, ways, slot_bytes
+FILE_HEADER_BYTES = 64
+SLOT_DTYPE = np.dtype([
+    ('seq', '<u8'),       # odd while a writer is rewriting the slot
+    ('key0', '<u8'),      # 128-bit key digest; 0, 0 marks an empty slot
+    ('key1', '<u8'),
+    ('used', '<f8'),      # last read or write, for eviction
+    ('expires', '<f8'),
+    ('length', '<u4'),
+    ('crc', '<u4')
+])
+
+
+def _reserve(fd, size):
+    """Allocate the file's space now, so a full filesystem fails here rather than on a page write"""
+    if hasattr(os, 'posix_fallocate'):
+        os.posix_fallocate(fd, 0, size)
+    else:
+        os.ftruncate(fd, size)
+
+
+def _read_header(fd):
+    return os.pread(fd, FILE_HEADER.size, 0) if hasattr(os, 'pread') else b''
+
+
+def key_digest(key):
+    """Two 64-bit integers identifying a str or bytes key"""
+    if isinstance(key, str):
+        key = key.encode('utf-8')
+    key0, key1 = struct.unpack('<QQ', hashlib.blake2b(key, digest_size=16).digest())
+    return key0, key1 or 1  # never the empty-slot marker
+
+
+class SharedCache:
+    """Fixed-size set-associative byte cache in a memory-mapped file shared across processes"""
+
+    def __init__(self, path, entries=4096, slot_bytes=4096, ways=8, ttl=3600):
+        self.path = path
+        self.ways = ways
+        self.sets = max(1, entries // ways)
+        self.slot_bytes = slot_bytes
+        self.ttl = ttl
+        self.hits = self.misses = self.stores = self.evictions = self.too_large = 0
+
+        slots = self.sets * self.ways
+        self._values_offset = FILE_HEADER_BYTES + slots * SLOT_DTYPE.itemsize
+        size = self._values_offset + slots * slot_bytes
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._fd = self._open_file(size, FILE_HEADER.pack(MAGIC, self.sets, self.ways, slot_bytes))
+        self._map = mmap.mmap(self._fd, size)  # the descriptor stays open: it carries the write lock
+        self.slots = np.frombuffer(self._map, dtype=SLOT_DTYPE, count=slots, offset=FILE_HEADER_BYTES)
+        self.values = np.frombuffer(self._map, dtype=np.uint8, count=slots * slot_bytes,
+                                    offset=self._values_offset).reshape(slots, slot_bytes)
+
+    def _open_file(self, size, header):
+        """Descriptor of the cache file with this geometry: the existing one, a new one sized in
+        place, or a replacement for one with another geometry"""
+        while True:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                with self._locked(fd):
+                    if os.fstat(fd).st_ino != os.stat(self.path).st_ino:
+                        outcome = 'retry'  # replaced while we waited for the lock
+                    elif os.fstat(fd).st_size == 0:
+                        # Just created, so nobody maps it yet
+                        try:
+                            _reserve(fd, size)
+                        except OSError:
+                            os.ftruncate(fd, 0)  # give back whatever was reserved
+                            raise
+                        os.pwrite(fd, header, 0)
+                        outcome = 'ready'
+                    elif os.fstat(fd).st_size == size and _read_header(fd) == header:
+                        _reserve(fd, size)
+                        outcome = 'ready'
+                    else:
+                        # Another geometry, possibly mapped by live processes: replace, never shrink
+                        outcome = self._replace_file(size, header)
+            except BaseException:
+                os.close(fd)
+                raise
+            if outcome == 'ready':
+                return fd
+            os.close(fd)
+            if outcome != 'retry':
+                return outcome
+
+    def _replace_file(self, size, header):
+        """Build a new file beside the cache file and rename it into place; its descriptor"""
+        directory, name = os.path.split(os.path.abspath(self.path))
+        fd, temp_path = tempfile.mkstemp(prefix=name + '.', suffix='.tmp', dir=directory)
+        try:
+            _reserve(fd, size)
+            os.pwrite(fd, header, 0)
+            os.replace(temp_path, self.path)
+        except BaseException:
+            os.close(fd)
+            os.unlink(temp_path)
+            raise
+        return fd
+
+    @contextmanager
+    def _locked(self, fd=None):
+        # One thread lock for every cache: a process's lockf locks do not exclude each other
+        with _process_lock:
+            if fcntl is None:
+                yield
+                return
+            fd = self._fd if fd is None else fd
+            fcntl.lockf(fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.lockf(fd, fcntl.LOCK_UN)
+
+    def _set_slots(self, key0):
+        first = (key0 % self.sets) * self.ways
+        return first, self.slots[first:first + self.ways]
+
+    def get(self, key):
+        """The cached bytes for key, or None"""
+        key0, key1 = key_digest(key)
+        first, ways = self._set_slots(key0)
+        for way in np.flatnonzero((ways['key0'] == key0) & (ways['key1'] == key1)):
+            value = self._read(first + int(way), key0, key1)
+            if value is not None:
+                self.hits += 1
+                return value
+        self.misses += 1
+        return None
+
+    def _read(self, index, key0, key1, attempts=3):
+        slot = self.slots[index:index + 1]
+        for _ in range(attempts):
+            seq = int(slot['seq'][0])
+            if seq & 1:
+                continue  # being rewritten
+            header = slot[0].copy()
+            value = self.values[index, :header['length']].tobytes()
+            if int(slot['seq'][0]) != seq:
+                continue
+            now = time.time()
+            if (header['key0'], header['key1']) != (key0, key1) or header['expires'] < now:
+                return None
+            if zlib.crc32(value) != header['crc']:
+                return None
+            slot['used'] = now  # unlocked touch: approximate LRU
+            return value
+        return None
+
+    def set(self, key, value, ttl=None):
+        """Store bytes under key; False when the value does not fit in a slot"""
+        if len(value) > self.slot_bytes:
+            self.too_large += 1
+            return False
+        key0, key1 = key_digest(key)
+        now = time.time()
+        with self._locked():
+            first, ways = self._set_slots(key0)
+            same = np.flatnonzero((ways['key0'] == key0) & (ways['key1'] == key1))
+            free = np.flatnonzero((ways['length'] == 0) | (ways['expires'] < now))
+            if len(same):
+                way = same[0]
+            elif len(free):
+                way = free[0]
+            else:
+                way = ways['used'].argmin()
+                self.evictions += 1
+            index = first + int(way)
+            slot = self.slots[index:index + 1]
+
+            seq = int(slot['seq'][0])
+            slot['seq'] = seq + 1
+            self.values[index, :len(value)] = np.frombuffer(value, dtype=np.uint8)
+            slot['key0'], slot['key1'] = key0, key1
+            slot['used'] = now
+            slot['expires'] = now + (self.ttl if ttl is None else ttl)
+            slot['length'] = len(value)
+            slot['crc'] = zlib.crc32(value)
+            slot['seq'] = seq + 2
+        self.stores += 1
+        return True
+
+    def stats(self):
+        """This process's counters and the shared occupancy"""
+        lookups = self.hits + self.misses
+        live = (self.slots['length'] > 0) & (self.slots['expires'] >= time.time())
+        return {
+            'path': self.path,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+            'stores': self.stores,
+            'evictions': self.evictions,
+            'too_large': self.too_large,
+            'entries': int(live.sum()),
+            'capacity': len(self.slots),
+            'slot_bytes': self.slot_bytes
+        }
+
+
+def open_shared_cache(settings, name):
+    """The `name` cache ('results' or 'reports') described by SHARED_CACHE_DEFAULTS-style settings"""
+    path = os.path.join(settings['directory'], f"{settings['namespace']}-{name}.cache")
+    return SharedCache(path, **settings[name])
@@ -0,0 +1,146 @@
+"""Live camera streaming - rolling diagnosis over a sequence of frames.
+
+A FrameStream sits between the connection that receives frames and the loop
+that analyses them. Only the newest unanalysed frame is kept, so when the
+analysis is slower than the camera the stale frames are dropped instead of
+queueing up. Results are smoothed over the last few analysed frames and a
+frame is only handed to `on_change` (which persists it) when the rolling
+diagnosis changes. An optional `precheck` can reject a frame (returning a
+reason code) before it is analysed.
+"""
+import io
+import threading
+import time
+from collections import Counter, deque
+
+
+class FrameStream:
+    """Latest-frame-wins buffer plus rolling diagnosis for one camera connection"""
+
+    def __init__(self, analyze, plant_type, window=5, on_change=None, precheck=None):
+        self.analyze = analyze
+        self.plant_type = plant_type
+        self.on_change = on_change
+        self.precheck = precheck
+        self.recent = deque(maxlen=window)
+        self.diagnosis = None
+
+        self._cond = threading.Condition()
+        self._pending = None
+        self._closed = False
+        self.error = None
+
+        self.received = 0
+        self.analysed = 0
+        self.skipped = 0
+        self.rejected = 0
+
+    def submit(self, frame_bytes, plant_type=None):
+        """Hand over a new frame; an older frame still waiting is dropped"""
+        with self._cond:
+            if self._pending is not None:
+                self.skipped += 1
+            self._pending = (frame_bytes, plant_type or self.plant_type)
+            self.received += 1
+            self._cond.notify()
+
+    def close(self, error=None):
+        """No more frames will arrive; an error is sent as the last update"""
+        with self._cond:
+            self._closed = True
+            self.error = self.error or error
+            self._cond.notify()
+
+    def next_frame(self):
+        """Wait for the newest frame, or return None once the stream is closed and drained"""
+        with self._cond:
+            while self._pending is None and not self._closed:
+                self._cond.wait()
+            frame, self._pending = self._pending, None
+            return frame
+
+    def process(self, frame_bytes, plant_type):
+        """Analyse one frame in memory and fold it into the rolling diagnosis"""
+        started = time.perf_counter()
+        if plant_type != self.plant_type:
+            # Frames of another plant must not vote on this one's diagnosis
+            self.recent.clear()
+            self.diagnosis = None
+            self.plant_type = plant_type
+
+        if self.precheck:
+            reason, metrics = self.precheck(frame_bytes)
+            if reason:
+                self.rejected += 1
+                return {
+                    'frame': self.received,
+                    'analysed': self.analysed,
+                    'skipped': self.skipped,
+                    'rejected': reason,
+                    'metrics': metrics
+                }
+
+        results = self.analyze(io.BytesIO(frame_bytes), plant_type)
+        self.analysed += 1
+
+        update = {
+            'frame': self.received,
+            'analysed': self.analysed,
+            'skipped': self.skipped,
+            'analysis_ms': round((time.perf_counter() - started) * 1000, 1)
+        }
+        if 'error' in results:
+            update['error'] = results['error']
+            return update
+
+        self.recent.append(results)
+        votes = Counter(r['disease_name'] for r in self.recent)
+        top_count = max(votes.values())
+        # Ties go to the most recent frame's diagnosis
+        diagnosis = next(r['disease_name'] for r in reversed(self.recent)
+                         if votes[r['disease_name']] == top_count)
+        latest = next(r for r in reversed(self.recent) if r['disease_name'] == diagnosis)
+
+        changed = diagnosis != self.diagnosis
+        self.diagnosis = diagnosis
+
+        update.update({
+            'plant_type': plant_type,
+            'disease_name': diagnosis,
+            'status': latest['status'],
+            'status_color': latest['status_color'],
+            'confidence': latest['confidence'],
+            'agreement': round(top_count / len(self.recent), 2),
+            'window': len(self.recent),
+            'frame_result': {
+                'disease_name': results['disease_name'],
+                'confidence': results['confidence'],
+                'green_ratio': results['green_ratio'],
+                'red_ratio': results['red_ratio'],
+                'color_variation': results['color_variation'],
+                'lesion_fraction': results['lesion_fraction'],
+                'chlorosis_fraction': results['chlorosis_fraction'],
+                'analysis_tier': results.get('analysis_tier')
+            },
+            'changed': changed
+        })
+
+        if changed:
+            update['treatments'] = latest['treatments']
+            update['prevention'] = latest['prevention']
+            if self.on_change:
+                image_filename = self.on_change(frame_bytes, latest)
+                if image_filename:
+                    update['image_filename'] = image_filename
+        return update
+
+    def updates(self):
+        """Yield one update per analysed frame until the stream is closed"""
+        while True:
+            frame = self.next_frame()
+            if frame is None:
+                if self.error:
+                    yield {'frame': self.received, 'analysed': self.analysed,
+                           'skipped': self.skipped, 'error': self.error}
+                return
+            yield self.process(*frame)
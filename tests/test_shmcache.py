@@ -0,0 +1,143 @@
+"""Shared cache tests: seqlock reads, eviction, and processes sharing one file.
+
+Run from the repository root with `python -m unittest discover tests`.
+"""
+import multiprocessing
+import os
+import tempfile
+import time
+import unittest
+
+from shmcache import SharedCache, fcntl
+
+fork = multiprocessing.get_context('fork') if hasattr(os, 'fork') else None
+
+
+def value_for(key, size):
+    """Deterministic bytes for a key, so readers can tell a torn read from a good one"""
+    pattern = key.encode('utf-8') + b'|'
+    return (pattern * (size // len(pattern) + 1))[:size]
+
+
+def hammer(path, worker, rounds, failures):
+    cache = SharedCache(path, entries=16, slot_bytes=2048)
+    for i in range(rounds):
+        key = f"k{(i * 7 + worker) % 40}"
+        cache.set(key, value_for(key, 500 + (i % 1500)))
+        for other in (f"k{i % 40}", f"k{(i + 13) % 40}"):
+            value = cache.get(other)
+            if value is not None and value != value_for(other, len(value)):
+                failures.value += 1
+
+
+def hold_lock(cache, locked, seconds):
+    with cache._locked():
+        locked.set()
+        time.sleep(seconds)
+
+
+def keep_writing(path, mapped, replaced, results):
+    cache = SharedCache(path, entries=16, slot_bytes=8192)
+    mapped.set()
+    replaced.wait(10)
+    ok = True
+    for i in range(100):
+        key = f"old{i}"
+        cache.set(key, value_for(key, 6000))
+        ok = ok and cache.get(key) == value_for(key, 6000)
+    results.put(ok)
+
+
+class SharedCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'test.cache')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_set_get_and_limits(self):
+        cache = SharedCache(self.path, entries=16, slot_bytes=64)
+        self.assertIsNone(cache.get('a'))
+        self.assertTrue(cache.set('a', b'one'))
+        self.assertEqual(cache.get('a'), b'one')
+        self.assertTrue(cache.set('a', b'two'))
+        self.assertEqual(cache.get('a'), b'two')
+        self.assertFalse(cache.set('big', b'x' * 65))
+        self.assertEqual(cache.too_large, 1)
+        cache.set('gone', b'x', ttl=-1)
+        self.assertIsNone(cache.get('gone'))
+
+    def test_other_process_sees_entries(self):
+        SharedCache(self.path, entries=16, slot_bytes=64).set('a', b'shared')
+        self.assertEqual(SharedCache(self.path, entries=16, slot_bytes=64).get('a'), b'shared')
+
+    def test_least_recently_used_is_evicted(self):
+        cache = SharedCache(self.path, entries=2, slot_bytes=64, ways=2)  # one set of two slots
+        cache.set('a', b'1')
+        cache.set('b', b'2')
+        cache.slots['used'] -= 10  # both stored long ago ...
+        self.assertEqual(cache.get('a'), b'1')  # ... then 'a' is read again
+        cache.set('c', b'3')
+        self.assertEqual(cache.evictions, 1)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), b'1')
+        self.assertEqual(cache.get('c'), b'3')
+
+    def test_slot_being_written_or_corrupt_is_a_miss(self):
+        cache = SharedCache(self.path, entries=8, slot_bytes=64)
+        cache.set('a', b'value')
+        index = int(cache.slots['length'].argmax())
+        cache.slots['seq'][index] += 1  # a writer is midway
+        self.assertIsNone(cache.get('a'))
+        cache.slots['seq'][index] += 1
+        self.assertEqual(cache.get('a'), b'value')
+        cache.values[index, 0] ^= 0xFF  # bytes no longer match the CRC
+        self.assertIsNone(cache.get('a'))
+
+    @unittest.skipUnless(fork and fcntl, 'needs fork and lockf')
+    def test_forked_child_excludes_parent_writer(self):
+        cache = SharedCache(self.path, entries=8, slot_bytes=64)
+        cache.set('warm', b'x')  # the parent has used its lock before forking
+        locked = fork.Event()
+        child = fork.Process(target=hold_lock, args=(cache, locked, 0.5))
+        child.start()
+        self.assertTrue(locked.wait(10))
+        started = time.monotonic()
+        cache.set('a', b'1')
+        self.assertGreater(time.monotonic() - started, 0.2)
+        child.join(10)
+        self.assertEqual(child.exitcode, 0)
+
+    @unittest.skipUnless(fork and fcntl, 'needs fork and lockf')
+    def test_concurrent_writers_and_readers(self):
+        SharedCache(self.path, entries=16, slot_bytes=2048)
+        failures = fork.Value('i', 0)
+        workers = [fork.Process(target=hammer, args=(self.path, worker, 2000, failures))
+                   for worker in range(4)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join(60)
+            self.assertEqual(worker.exitcode, 0)
+        self.assertEqual(failures.value, 0)
+
+    @unittest.skipUnless(fork, 'needs fork')
+    def test_geometry_change_leaves_mapped_file_intact(self):
+        mapped, replaced, results = fork.Event(), fork.Event(), fork.Queue()
+        old = fork.Process(target=keep_writing, args=(self.path, mapped, replaced, results))
+        old.start()
+        self.assertTrue(mapped.wait(10))
+        new = SharedCache(self.path, entries=16, slot_bytes=4096)
+        new.set('new', b'fresh')
+        replaced.set()
+        old.join(30)
+        self.assertEqual(old.exitcode, 0)  # no SIGBUS from a shrunk mapping
+        self.assertTrue(results.get(timeout=5))
+        self.assertEqual(SharedCache(self.path, entries=16, slot_bytes=4096).get('new'), b'fresh')
+        self.assertEqual(os.listdir(self.directory.name), ['test.cache'])
+
+
+if __name__ == '__main__':
+    unittest.main()
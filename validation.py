@@ -0,0 +1,94 @@
+"""Header-only image validation and decompression-bomb protection.
+
+`Image.open` only parses the header, so the real format, dimensions, mode and
+frame count are known before any pixel data is decoded. `inspect_image` checks
+them against IMAGE_LIMITS and says how far a JPEG has to be downscaled by the
+decoder (draft mode) to fit the decode memory budget. A PNG cannot be decoded
+at reduced size, so an oversized PNG is rejected instead.
+
+Many phone cameras write MPO files: a normal JPEG followed by extra images
+(a preview or depth map). Pillow reports them as 'MPO' with several frames;
+they are accepted as JPEGs and only the first frame is decoded.
+"""
+import io
+import math
+import warnings
+
+from PIL import Image
+
+JPEG_FORMATS = ('JPEG', 'MPO')  # decoded with the JPEG decoder, so draft mode works
+
+IMAGE_LIMITS = {
+    'formats': ('JPEG', 'MPO', 'PNG'),
+    'modes': ('1', 'L', 'LA', 'P', 'RGB', 'RGBA', 'CMYK', 'YCbCr'),
+    'max_frames': 1,
+    'max_pixels': 50_000_000,            # larger images are rejected outright
+    'memory_budget': 64 * 1024 * 1024    # decoded pixel bytes; larger JPEGs are decoded downscaled
+}
+
+REASONS = {
+    'unreadable': 'File is not a readable image',
+    'unsupported_format': 'Only JPEG and PNG images are accepted',
+    'unsupported_mode': 'Unsupported image color mode',
+    'animated': 'Animated images are not accepted',
+    'too_many_pixels': 'Image dimensions are too large',
+    'too_large': 'Image needs too much memory to decode'
+}
+
+
+def decoded_bytes(width, height, mode):
+    return width * height * Image.getmodebands(mode)
+
+
+def draft_scale(img, memory_budget):
+    """Smallest JPEG decoder scale (1, 2, 4 or 8) that keeps the decoded image within budget, else None"""
+    for scale in (1, 2, 4, 8):
+        width, height = math.ceil(img.width / scale), math.ceil(img.height / scale)
+        if decoded_bytes(width, height, img.mode) <= memory_budget:
+            return scale
+        if img.format not in JPEG_FORMATS:
+            return None
+    return None
+
+
+def fit_to_budget(img, memory_budget):
+    """Switch a freshly opened JPEG to reduced-size decoding when full size would exceed the budget"""
+    scale = draft_scale(img, memory_budget)
+    if scale and scale > 1:
+        img.draft(img.mode, (math.ceil(img.width / scale), math.ceil(img.height / scale)))
+    return img
+
+
+def inspect_image(image_data, limits=IMAGE_LIMITS):
+    """(reason code or None, header info) from the image header alone"""
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter('error', Image.DecompressionBombWarning)
+            img = Image.open(io.BytesIO(image_data))
+    except (Image.DecompressionBombError, Image.DecompressionBombWarning):
+        return 'too_many_pixels', {}
+    except Exception:
+        return 'unreadable', {}
+
+    with img:
+        info = {
+            'format': img.format,
+            'width': img.width,
+            'height': img.height,
+            'mode': img.mode,
+            'frames': getattr(img, 'n_frames', 1)
+        }
+        if img.format not in limits['formats']:
+            return 'unsupported_format', info
+        if img.mode not in limits['modes']:
+            return 'unsupported_mode', info
+        if info['frames'] > limits['max_frames'] and img.format != 'MPO':  # MPO: first frame only
+            return 'animated', info
+        if img.width * img.height > limits['max_pixels']:
+            return 'too_many_pixels', info
+
+        scale = draft_scale(img, limits['memory_budget'])
+        if scale is None:
+            return 'too_large', info
+        info['decode_scale'] = scale
+        return None, info